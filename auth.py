@@ -0,0 +1,113 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Password checks shared by the views, argon2 runs in a bounded pool of threads and
+#passwords already verified are remembered in the signed session cookie until it expires
+
+import os
+import hmac
+import time
+import hashlib
+import threading
+from argon2 import PasswordHasher
+from concurrent.futures import ThreadPoolExecutor
+
+
+HASHER = PasswordHasher()
+#Threads verifying passwords per web worker and verifications allowed to wait for one
+WORKERS = 2
+BACKLOG = 8
+POOL = None
+SLOTS = None
+PID = None
+LOCK = threading.Lock()
+
+
+def configure(workers:int=2, backlog:int=8):
+    global WORKERS, BACKLOG
+    assert workers > 0, "At least one thread must verify passwords"
+    shutdown()
+    WORKERS = workers
+    BACKLOG = max(backlog, 0)
+    return
+
+
+def executor()->tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    #Threads don't survive fork, every web worker builds its own pool on first use
+    global POOL, SLOTS, PID
+    with LOCK:
+        if POOL is None or PID != os.getpid():
+            POOL = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="argon2")
+            SLOTS = threading.BoundedSemaphore(WORKERS+BACKLOG)
+            PID = os.getpid()
+        return POOL, SLOTS
+
+
+def shutdown():
+    global POOL
+    with LOCK:
+        if POOL is not None and PID == os.getpid():
+            POOL.shutdown(wait=False, cancel_futures=True)
+        POOL = None
+    return
+
+
+def check(hashed:str, password:str)->bool:
+    try:
+        return HASHER.verify(hashed, password)
+    except Exception:
+        return False
+
+
+def verify(hashed:str, password:str)->bool:
+    #With every thread busy and the backlog full, a verification fails right away like a wrong password
+    pool, slots = executor()
+    if not slots.acquire(blocking=False):
+        return False
+    try:
+        return pool.submit(check, hashed, password).result()
+    finally:
+        slots.release()
+
+
+def fingerprint(key:str, password:str)->str:
+    #Only a keyed digest of the password goes into the cookie
+    return hmac.new(str(key).encode(), password.encode(), hashlib.sha256).hexdigest()
+
+
+def granted(session)->dict[str, str]:
+    if session.get("expires", 0) < time.time():
+        session.pop("expires", None)
+        session.pop("grants", None)
+        return {}
+    return session.get("grants", {})
+
+
+def grant(session, level:str, mark:str, ttl:int):
+    grants = granted(session)
+    if not grants:
+        session["expires"] = time.time()+ttl
+        session.permanent = True
+    session["grants"] = {**grants, level:mark}
+    return
+
+
+def authenticate(session, config:dict, password:str, levels:list[str], hashes:dict[str, str]=None, scope:str="")->str:
+    #First of levels the password matches, "" if none. Levels are keys of hashes (config by default),
+    #grants are kept apart per scope. An empty password uses the levels already granted to the session
+    hashes = config if hashes is None else hashes
+    grants = granted(session)
+    names = {level:f"{scope}/{level}" if scope else level for level in levels}
+    if not password:
+        for level in levels:
+            if names[level] in grants:
+                return level
+        return ""
+    mark = fingerprint(config["SECRET_KEY"], password)
+    for level in levels:
+        if hmac.compare_digest(grants.get(names[level], ""), mark):
+            return level
+    for level in levels:
+        if hashes.get(level) and verify(hashes[level], password):
+            grant(session, names[level], mark, config["SESSION_TTL"])
+            return level
+    return ""
@@ -0,0 +1,100 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Seeded synthetic ledgers over the five default types, the same seed and size always give the same records
+#Run from the repository root: python3 benchmarks/generate.py ledger.db --records 1000000
+
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import snapshot
+import sqlite3 as sql
+import database as db
+
+
+TYPES = ["Income", "Necessity", "Pleasure", "Investment", "Emergency"]
+#Share of the records and range of the amounts (cents) of each type, outflows are negative
+SHARES = [0.08, 0.5, 0.3, 0.07, 0.05]
+AMOUNTS = [(50000, 400000), (-60000, -100), (-25000, -200), (-100000, 100000), (-300000, -5000)]
+DESCRIPTIONS = [
+    ["salary", "bonus", "freelance", "refund", "interest"],
+    ["rent", "groceries", "electricity", "water", "internet", "transport", "insurance", "pharmacy"],
+    ["cinema", "restaurant", "coffee", "concert ticket", "books", "travel", "games"],
+    ["bond", "index fund", "stock", "savings deposit"],
+    ["dentist", "car repair", "hospital", "plumber"],
+]
+START = "2015-01-01"
+YEARS = 10
+
+
+def ledger(records:int, seed:int=7, start:str=START, years:int=YEARS)->tuple[dict, dict[str, np.ndarray]]:
+    #Records as the header and columns of a snapshot (see snapshot.py), generated without a Python loop per record
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(len(TYPES), size=records, p=SHARES)
+    low = np.array([a[0] for a in AMOUNTS])[kinds]
+    high = np.array([a[1] for a in AMOUNTS])[kinds]
+    amounts = rng.integers(low, high, endpoint=True)
+    first = np.datetime64(start, "D").astype(np.int64)
+    dates = (first+rng.integers(0, 365*years, size=records)).astype("<i4")
+    strings = [d for descriptions in DESCRIPTIONS for d in descriptions]
+    offsets = np.cumsum([0]+[len(d) for d in DESCRIPTIONS])
+    picks = rng.random(records)
+    descriptions = offsets[kinds]+(picks*np.diff(offsets)[kinds]).astype(np.int64)
+    text = [s.encode() for s in strings]
+    bounds = np.zeros(len(text)+1, dtype="<u8")
+    np.cumsum([len(t) for t in text], out=bounds[1:])
+    arrays = {
+        "type":(kinds+1).astype("<u2"),
+        "amount":amounts.astype("<i8"),
+        "date":dates,
+        "description":descriptions.astype("<u4"),
+        "strings":bounds,
+        "text":np.frombuffer(b"".join(text), dtype="u1"),
+    }
+    header = {"rows":records, "types":[[i+1, type_] for i, type_ in enumerate(TYPES)], "columns":{}}
+    return header, arrays
+
+
+def lines(records:int, seed:int=7)->list[str]:
+    #Same records as Type|Description|Amount|Date lines
+    _, arrays = ledger(records, seed)
+    text = arrays["text"].tobytes()
+    bounds = arrays["strings"]
+    strings = [text[bounds[i]:bounds[i+1]].decode() for i in range(len(bounds)-1)]
+    dates = np.datetime_as_string(arrays["date"].astype("datetime64[D]")).tolist()
+    return [f"{TYPES[t-1]}|{strings[d]}|{a/100}|{day}" for t, d, a, day in\
+            zip(arrays["type"].tolist(), arrays["description"].tolist(), arrays["amount"].tolist(), dates)]
+
+
+def create(location:str, records:int, seed:int=7, size:int=50000)->str:
+    #New database at location, loaded through the snapshot bulk path so 10M records take minutes, not hours
+    db.init(location)
+    header, arrays = ledger(records, seed)
+    cn = sql.connect(location)
+    try:
+        snapshot.load(cn, header, arrays, replace=True, size=size)
+    finally:
+        cn.close()
+    return location
+
+
+def main():
+    prs = argparse.ArgumentParser(description="Generate a synthetic ledger")
+    prs.add_argument("output", help="Database to create, or text file with --text")
+    prs.add_argument("--records", type=int, default=100000)
+    prs.add_argument("--seed", type=int, default=7)
+    prs.add_argument("--text", action="store_true", help="Write Type|Description|Amount|Date lines instead of a database")
+    args = prs.parse_args()
+    if args.text:
+        with open(args.output, "w") as fd:
+            fd.write("\n".join(lines(args.records, args.seed))+"\n")
+    else:
+        create(args.output, args.records, args.seed)
+    print(f"Generated {args.records} records in {args.output}")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Per line (database.load) against batch (ingest.parse) parsing of Type|Description|Amount|Date lines
+#Run from the repository root: python3 benchmarks/parse.py --lines 1000000
+
+import os
+import sys
+import time
+import random
+import argparse
+import contextlib
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ingest
+import database as db
+
+
+TYPES = {"Income":1, "Necessity":2, "Pleasure":3, "Investment":4, "Emergency":5}
+
+
+def lines(count:int, seed:int, invalid:float)->list[str]:
+    rng = random.Random(seed)
+    kinds = list(TYPES.keys())
+    generated = []
+    for i in range(count):
+        line = f"{rng.choice(kinds)}|record {i}|{rng.uniform(-500, 500):.2f}|{rng.randint(2000, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        if rng.random() < invalid:
+            line = line.replace("|", "|x", 1) if rng.random() < 0.5 else line[:-3]
+        generated.append(line)
+    return generated
+
+
+def measure(function, repeat:int)->float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter()-started)
+    return best
+
+
+def main():
+    prs = argparse.ArgumentParser(description="Compare per line and batch parsing of records")
+    prs.add_argument("--lines", type=int, default=200000)
+    prs.add_argument("--seed", type=int, default=7)
+    prs.add_argument("--invalid", type=float, default=0.01, help="Fraction of malformed lines")
+    prs.add_argument("--repeat", type=int, default=3)
+    args = prs.parse_args()
+    data = lines(args.lines, args.seed, args.invalid)
+    with contextlib.redirect_stdout(StringIO()):
+        expected = db.load(data, TYPES, delimiter="|")
+        per_line = measure(lambda: db.load(data, TYPES, delimiter="|"), args.repeat)
+    parsed = list(ingest.parse(data, TYPES, ingest.Report()))
+    assert parsed == expected, "Batch parsing produced different records"
+    batch = measure(lambda: list(ingest.parse(data, TYPES, ingest.Report())), args.repeat)
+    print(f"lines: {args.lines} valid: {len(expected)}")
+    print(f"per line: {per_line:.3f} s ({args.lines/per_line:,.0f} lines/s)")
+    print(f"batch:    {batch:.3f} s ({args.lines/batch:,.0f} lines/s)")
+    print(f"speedup:  {per_line/batch:.1f}x")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Times the database, report, backup, parsing and chart functions on synthetic ledgers and writes the results as JSON.
+#Run from the repository root: python3 benchmarks/suite.py --records 10000 1000000 --output bench.json
+#and compare two runs with: python3 benchmarks/suite.py --compare before.json after.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import svg
+import graph
+import render
+import generate
+import numpy as np
+import sqlite3 as sql
+import database as db
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Filters of the custom report and of the filtered database functions
+FILTERS = {"type_":"Necessity", "description":"rent", "start":datetime(2017, 1, 1), "end":datetime(2022, 12, 31)}
+
+
+def measure(function, repeat:int, setup=None)->dict:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter()-started)
+    return {"best":min(times), "median":statistics.median(times), "runs":repeat}
+
+
+def consume(iterator):
+    for _ in iterator:
+        pass
+    return
+
+
+def cases(cursor:sql.Cursor, records:int, seed:int, static_dir:str)->list[tuple]:
+    #(name, function, setup) of everything timed against one ledger
+    types = db.get_types(cursor)
+    text = generate.lines(min(records, 100000), seed)
+    flows = db.daily_flow(cursor)
+    months = db.monthly_flow(cursor)
+    amounts = [r[0] for r in cursor.execute("SELECT amount FROM records;")]
+    picture = os.path.join(static_dir, "picture")
+    inserted = [db.Record(types["Pleasure"], "benchmark insert", -1.0, "2020-01-01") for _ in range(1000)]
+    def insert():
+        db.insert(cursor, inserted)
+        cursor.connection.rollback()
+    def delete():
+        db.delete(cursor, type_="Necessity", start=datetime(2019, 1, 1), end=datetime(2019, 12, 31))
+        cursor.connection.rollback()
+    def rebuild():
+        #DROP TABLE doesn't open a transaction by itself
+        cursor.execute("BEGIN;")
+        db.rebuild_rollup(cursor)
+        cursor.connection.rollback()
+    def clean():
+        #Charts are drawn every run instead of being served from the cache
+        shutil.rmtree(static_dir)
+        os.mkdir(static_dir)
+    return [
+        ("database.get_types", lambda: db.get_types(cursor), None),
+        ("database.peek", lambda: db.peek(cursor), None),
+        ("database.peek.all", lambda: db.peek(cursor, limit=-1), None),
+        ("database.export", lambda: consume(db.export(cursor)), None),
+        ("database.apply_filters", lambda: db.apply_filters(cursor=cursor, **FILTERS), None),
+        ("database.insert.1000", insert, None),
+        ("database.delete.year", delete, None),
+        ("database.delete_preview", lambda: db.delete_preview(cursor, **FILTERS), None),
+        ("database.load", lambda: db.load(text, types, delimiter="|"), None),
+        ("database.verify_rollup", lambda: db.verify_rollup(cursor), None),
+        ("database.rebuild_rollup", rebuild, None),
+        ("database.data_version", lambda: db.data_version(cursor), None),
+        ("database.daily_flow", lambda: db.daily_flow(cursor), None),
+        ("database.daily_flow.filtered", lambda: db.daily_flow(cursor, **FILTERS), None),
+        ("database.monthly_flow", lambda: db.monthly_flow(cursor), None),
+        ("database.monthly_flow.filtered", lambda: db.monthly_flow(cursor, **FILTERS), None),
+        ("database.monthly_flow_mean", lambda: db.monthly_flow_mean(cursor), None),
+        ("database.monthly_flow_max", lambda: db.monthly_flow_max(cursor), None),
+        ("database.monthly_flow_min", lambda: db.monthly_flow_min(cursor), None),
+        ("database.monthly_flow_var", lambda: db.monthly_flow_var(cursor), None),
+        ("database.monthly_flow_sd", lambda: db.monthly_flow_sd(cursor), None),
+        ("database.monthly_flow_median", lambda: db.monthly_flow_median(cursor), None),
+        ("database.flow.week", lambda: db.flow(cursor, "week"), None),
+        ("database.flow.quarter", lambda: db.flow(cursor, "quarter"), None),
+        ("database.cumulative", lambda: db.cumulative(cursor), None),
+        ("database.balances", lambda: db.balances(cursor), None),
+        ("database.balances.day", lambda: db.balances(cursor, "day"), None),
+        ("database.balances.by_type", lambda: db.balances(cursor, "day", by_type=True), None),
+        ("database.balances.filtered", lambda: db.balances(cursor, **FILTERS), None),
+        ("database.sum_sign", lambda: db.sum_sign(cursor, select="positive"), None),
+        ("database.get_max", lambda: db.get_max(cursor, limit=5), None),
+        ("database.get_min", lambda: db.get_min(cursor, limit=5), None),
+        ("database.get_stats", lambda: db.get_stats(cursor), None),
+        ("database.get_stats.filtered", lambda: db.get_stats(cursor, **FILTERS), None),
+        ("database.get_avg", lambda: db.get_avg(cursor), None),
+        ("database.get_var", lambda: db.get_var(cursor), None),
+        ("database.get_std", lambda: db.get_std(cursor), None),
+        ("database.get_count", lambda: db.get_count(cursor), None),
+        ("database.get_median", lambda: db.get_median(cursor), None),
+        ("database.get_quantile", lambda: db.get_quantile(cursor, 0.9), None),
+        ("database.fill_months", lambda: db.fill_months(months), None),
+        ("database.accumulate", lambda: db.accumulate(flows), None),
+        ("database.mean", lambda: db.mean(amounts), None),
+        ("database.variance", lambda: db.variance(amounts), None),
+        ("database.median", lambda: db.median(amounts), None),
+        ("render.main_report", lambda: render.main_report(cursor, static_dir=static_dir), clean),
+        ("render.main_report.charts_cached", lambda: render.main_report(cursor, static_dir=static_dir), None),
+        ("render.custom_report", lambda: render.custom_report(cursor, static_dir=static_dir, **FILTERS), clean),
+        ("render.backup", lambda: consume(render.backup(cursor)), None),
+        ("render.backup.gzip", lambda: consume(render.backup(cursor, compress=True)), None),
+        ("graph.series", lambda: graph.series(flows, save=picture+".png"), None),
+        ("graph.mseries", lambda: graph.mseries([flows, months], save=picture+".png", labels=["Daily", "Monthly"]), None),
+        ("graph.bar", lambda: graph.bar([m[0] for m in months[-12:]], [abs(m[1]) for m in months[-12:]],\
+                                        [abs(m[1]) for m in months[-12:]], save=picture+".png"), None),
+        ("svg.series", lambda: svg.series(flows, save=picture+".svg"), None),
+        ("svg.mseries", lambda: svg.mseries([flows, months], save=picture+".svg", labels=["Daily", "Monthly"]), None),
+    ]
+
+
+def revision()->str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(sizes:list[int], seed:int, repeat:int, workdir:str, only:str="")->dict:
+    results = {
+        "meta":{
+            "commit":revision(),
+            "date":datetime.now().isoformat(timespec="seconds"),
+            "python":platform.python_version(),
+            "sqlite":sql.sqlite_version,
+            "numpy":np.__version__,
+            "machine":platform.platform(),
+            "cpus":os.cpu_count(),
+            "seed":seed,
+            "repeat":repeat,
+        },
+        "results":{},
+    }
+    for records in sizes:
+        #Generated ledgers are kept in workdir and reused by later runs with the same size and seed
+        location = os.path.join(workdir, f"ledger-{records}-{seed}.db")
+        if not os.path.isfile(location):
+            print(f"Generating {records} records", file=sys.stderr)
+            generate.create(location, records, seed)
+        static_dir = tempfile.mkdtemp(prefix="charts-", dir=workdir)
+        cn = sql.connect(location)
+        timings = {}
+        try:
+            for name, function, setup in cases(cn.cursor(), records, seed, static_dir):
+                if only and only not in name:
+                    continue
+                timings[name] = measure(function, repeat, setup)
+                print(f"{records:>10} {name:<36} {timings[name]['best']*1000:10.2f} ms", file=sys.stderr)
+        finally:
+            cn.close()
+            shutil.rmtree(static_dir, ignore_errors=True)
+        results["results"][str(records)] = timings
+    return results
+
+
+def compare(before:str, after:str, threshold:float)->int:
+    #Ratios of the best times after/before, cases slower than threshold are regressions
+    with open(before) as fd:
+        old = json.load(fd)["results"]
+    with open(after) as fd:
+        new = json.load(fd)["results"]
+    regressions = 0
+    for size in sorted(set(old)&set(new), key=int):
+        for name in sorted(set(old[size])&set(new[size])):
+            ratio = new[size][name]["best"]/max(old[size][name]["best"], 1e-9)
+            mark = ""
+            if ratio > threshold:
+                regressions+=1
+                mark = " REGRESSION"
+            print(f"{size:>10} {name:<36} {old[size][name]['best']*1000:10.2f} ms {new[size][name]['best']*1000:10.2f} ms {ratio:6.2f}x{mark}")
+    return 1 if regressions else 0
+
+
+def main():
+    prs = argparse.ArgumentParser(description="Benchmark AutoFinance on synthetic ledgers")
+    prs.add_argument("--records", type=int, nargs="+", default=[10000, 100000], help="Ledger sizes, 10k to 10M")
+    prs.add_argument("--seed", type=int, default=7)
+    prs.add_argument("--repeat", type=int, default=3)
+    prs.add_argument("--only", default="", help="Only cases whose name contains this text")
+    prs.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "autofinance-bench"))
+    prs.add_argument("--output", default="", help="JSON file for the results (default: stdout)")
+    prs.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files instead of running")
+    prs.add_argument("--threshold", type=float, default=1.2, help="Slowdown reported as a regression by --compare")
+    args = prs.parse_args()
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+    os.makedirs(args.workdir, exist_ok=True)
+    results = run(args.records, args.seed, args.repeat, args.workdir, args.only)
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Least recently used cache of report contexts kept in a SQLite file shared by every web worker.
+#Entries are keyed by the report, its parameters and the data version of the ledger, a write to a
+#ledger makes its entries stale and those are dropped on the next store for that ledger
+
+import json
+import time
+import hashlib
+import connections
+import sqlite3 as sql
+
+
+class Cache:
+
+    def __init__(self, location:str, size:int=64, timeout:float=1):
+        self.location = location
+        self.size = size
+        self.timeout = timeout
+        self.connection = connections.Local(location, timeout, ["journal_mode=WAL", "synchronous=OFF"])
+        if size:
+            cn = self.connection.get()
+            columns = [c[1] for c in cn.execute("PRAGMA table_info(reports);")]
+            if columns and "ledger" not in columns:
+                cn.execute("DROP TABLE reports;")
+            cn.execute("CREATE TABLE IF NOT EXISTS reports(key TEXT PRIMARY KEY, ledger TEXT, version INTEGER, used REAL, context TEXT);")
+            cn.commit()
+
+    @staticmethod
+    def key(kind:str, params:dict, version:int, ledger:str="")->str:
+        content = json.dumps([ledger, kind, params, version], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key:str)->dict:
+        if not self.size:
+            return None
+        try:
+            cn = self.connection.get()
+            found = list(cn.execute("SELECT context FROM reports WHERE key=?;", (key,)))
+            if not found:
+                return None
+            cn.execute("UPDATE reports SET used=? WHERE key=?;", (time.time(), key))
+            cn.commit()
+        except sql.Error:
+            #A busy or broken cache is a miss, never a failed report
+            return None
+        return json.loads(found[0][0])
+
+    def put(self, key:str, version:int, context:dict, ledger:str=""):
+        if not self.size:
+            return
+        try:
+            cn = self.connection.get()
+            cn.execute("INSERT OR REPLACE INTO reports(key, ledger, version, used, context) VALUES(?,?,?,?,?);",\
+                       (key, ledger, version, time.time(), json.dumps(context, default=str)))
+            cn.execute("DELETE FROM reports WHERE ledger=? AND version<?;", (ledger, version))
+            cn.execute("DELETE FROM reports WHERE key NOT IN (SELECT key FROM reports ORDER BY used DESC LIMIT ?);", (self.size,))
+            cn.commit()
+        except sql.Error:
+            pass
+        return
+
+    def clear(self):
+        if self.size:
+            cn = self.connection.get()
+            cn.execute("DELETE FROM reports;")
+            cn.commit()
+        return
@@ -0,0 +1,186 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Content addressed cache of rendered charts, drawn in a pool of processes
+
+import os
+import json
+import uuid
+import time
+import atexit
+import hashlib
+import metrics
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+
+
+#Bump when the look of the charts changes so cached pictures are not reused
+VERSION = 1
+#Picture format -> module drawing it, matplotlib is only imported by graph
+BACKENDS = {"png":"graph", "svg":"svg"}
+BACKEND = "png"
+WORKERS = 0
+POOL = None
+LOCK = threading.Lock()
+
+
+def key(kind:str, *args, **kwargs)->str:
+    content = json.dumps([VERSION, BACKEND, kind, args, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def job(kind:str, *args, **kwargs)->tuple[str, tuple, dict]:
+    return kind, args, kwargs
+
+
+def hit(static_dir:str, name:str)->bool:
+    location = os.path.join(static_dir, name)
+    if os.path.isfile(location):
+        try:
+            os.utime(location)
+        except OSError:
+            return False
+        return True
+    return False
+
+
+def draw(static_dir:str, name:str, kind:str, args:tuple, kwargs:dict)->str:
+    #The extension of name selects the backend, render processes don't share this module's configuration
+    extension = os.path.splitext(name)[1]
+    backend = importlib.import_module(BACKENDS[extension[1:]])
+    #Render to a private file first so concurrent requests never see a partial picture
+    partial = os.path.join(static_dir, f".{uuid.uuid4()}{extension}")
+    try:
+        with metrics.phase(f"charts.draw.{kind}"):
+            saved = getattr(backend, kind)(*args, save=partial, **kwargs)
+        if not saved:
+            return ""
+        os.replace(partial, os.path.join(static_dir, name))
+    finally:
+        if os.path.isfile(partial):
+            os.remove(partial)
+    return name
+
+
+def configure(workers:int=0, backend:str="png"):
+    #Number of processes rendering charts, 0 renders them in the calling thread
+    global WORKERS, BACKEND
+    assert backend in BACKENDS, f"Chart backend must be: {','.join(list(BACKENDS.keys()))}"
+    shutdown()
+    WORKERS = max(workers, 0)
+    BACKEND = backend
+    return
+
+
+def executor()->ProcessPoolExecutor:
+    #Created on first use so every (forked) web worker gets its own pool
+    global POOL
+    with LOCK:
+        if POOL is None and WORKERS:
+            #Spawned processes don't share the imports of the web worker, each one loads the backend as it starts
+            POOL = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"),\
+                                       initializer=importlib.import_module, initargs=(BACKENDS[BACKEND],))
+        return POOL
+
+
+def warm():
+    #Starts the render processes of a web worker before its first report, one per task submitted while none is idle
+    pool = executor()
+    if pool is not None:
+        for _ in range(WORKERS):
+            pool.submit(time.time)
+    return
+
+
+def preload():
+    #Imports the configured backend, for matplotlib this also builds its font cache
+    importlib.import_module(BACKENDS[BACKEND])
+    return
+
+
+def shutdown():
+    global POOL
+    with LOCK:
+        if POOL is not None:
+            POOL.shutdown(wait=True, cancel_futures=True)
+        POOL = None
+    return
+
+
+def render(static_dir:str, jobs:list[tuple[str, tuple, dict]])->list[str]:
+    #File names inside static_dir of the rendered charts, empty for charts with nothing to draw
+    names = [key(kind, *args, **kwargs)+"."+BACKEND for kind, args, kwargs in jobs]
+    results = ["" for _ in jobs]
+    pending = {}
+    pool = executor()
+    for i, (name, (kind, args, kwargs)) in enumerate(zip(names, jobs)):
+        if hit(static_dir, name):
+            results[i] = name
+        elif pool is not None:
+            try:
+                pending[i] = pool.submit(draw, static_dir, name, kind, args, kwargs)
+            except BrokenProcessPool:
+                results[i] = draw(static_dir, name, kind, args, kwargs)
+        else:
+            results[i] = draw(static_dir, name, kind, args, kwargs)
+    broken = False
+    for i, future in pending.items():
+        try:
+            with metrics.phase("charts.wait"):
+                results[i] = future.result()
+        except (BrokenProcessPool, CancelledError):
+            broken = True
+            results[i] = draw(static_dir, names[i], *jobs[i])
+    if broken:
+        shutdown()
+    return results
+
+
+def cached(static_dir:str, kind:str, *args, **kwargs)->str:
+    return render(static_dir, [job(kind, *args, **kwargs)])[0]
+
+
+def series(static_dir:str, records:list, **kwargs)->str:
+    return cached(static_dir, "series", records, **kwargs)
+
+
+def mseries(static_dir:str, records:list, **kwargs)->str:
+    return cached(static_dir, "mseries", records, **kwargs)
+
+
+def bar(static_dir:str, xs:list[str], ins:list[float], out:list[float], **kwargs)->str:
+    return cached(static_dir, "bar", xs, ins, out, **kwargs)
+
+
+def prune(static_dir:str, max_files:int=256, ttl:int=86400, grace:int=60):
+    #Charts used within the last grace seconds may be served by another request and are never removed
+    assert os.path.isdir(static_dir), f"'{static_dir}' is not a directory"
+    now = time.time()
+    entries = []
+    for f in os.listdir(static_dir):
+        location = os.path.join(static_dir, f)
+        try:
+            used = os.path.getmtime(location)
+        except OSError:
+            continue
+        if not os.path.isfile(location) or now-used < grace:
+            continue
+        if now-used > ttl or f.startswith("."):
+            try:
+                os.remove(location)
+            except OSError:
+                pass
+        else:
+            entries.append((used, location))
+    entries.sort()
+    for _, location in entries[:max(len(entries)-max_files, 0)]:
+        try:
+            os.remove(location)
+        except OSError:
+            pass
+    return
+
+
+atexit.register(shutdown)
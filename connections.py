@@ -0,0 +1,125 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#SQLite connections reused by a web worker: a pool per database and a connection per thread for small shared files
+
+import os
+import queue
+import threading
+import sqlite3 as sql
+from contextlib import contextmanager
+
+
+class Pool:
+    #Connections are opened lazily and kept per process, a pool inherited through fork starts empty
+
+    def __init__(self, location:str, size:int=4, mmap_size:int=268435456, cache_size:int=65536, timeout:float=10,\
+                 factory:type=sql.Connection, streams:int=2):
+        self.location = location
+        self.factory = factory
+        self.size = size
+        self.streams = streams
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.closed = False
+        self.idle = {False:queue.LifoQueue(), True:queue.LifoQueue()}
+        self.slots = {False:threading.BoundedSemaphore(self.size), True:threading.BoundedSemaphore(self.size),\
+                      "stream":threading.BoundedSemaphore(self.streams)}
+        return
+
+    def open(self, readonly:bool)->sql.Connection:
+        if readonly:
+            cn = sql.connect(f"file:{self.location}?mode=ro", uri=True, timeout=self.timeout, check_same_thread=False, factory=self.factory)
+            cn.execute("PRAGMA query_only=ON;")
+        else:
+            cn = sql.connect(self.location, timeout=self.timeout, check_same_thread=False, factory=self.factory)
+            cn.execute("PRAGMA journal_mode=WAL;")
+        cn.execute("PRAGMA synchronous=NORMAL;")
+        cn.execute(f"PRAGMA mmap_size={int(self.mmap_size)};")
+        cn.execute(f"PRAGMA cache_size={-int(self.cache_size)};")
+        cn.execute("PRAGMA temp_store=MEMORY;")
+        return cn
+
+    def acquire(self, readonly:bool=False, stream:bool=False)->sql.Connection:
+        #Blocks while size connections of the same kind are in use. A stream connection is read-only and held while a
+        #response is sent, as long as the client takes, so those have their own slots and can't starve the other requests
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+        slot = self.slots["stream" if stream else readonly]
+        readonly = readonly or stream
+        #A closed pool still serves the requests that got it before it was closed (a ledger evicted meanwhile),
+        #those connections are closed when released
+        if not slot.acquire(timeout=self.timeout):
+            raise TimeoutError("No database connection available")
+        try:
+            return self.idle[readonly].get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self.open(readonly)
+        except Exception:
+            slot.release()
+            raise
+
+    def release(self, cn:sql.Connection, readonly:bool=False, stream:bool=False):
+        slot = self.slots["stream" if stream else readonly]
+        readonly = readonly or stream
+        if cn.in_transaction:
+            cn.rollback()
+        with self.lock:
+            closed = self.closed
+            if not closed:
+                self.idle[readonly].put(cn)
+        if closed:
+            cn.close()
+        slot.release()
+        return
+
+    @contextmanager
+    def connection(self, readonly:bool=False):
+        cn = self.acquire(readonly)
+        try:
+            yield cn
+        finally:
+            self.release(cn, readonly)
+
+    def close(self):
+        #Idle connections are closed now, the ones in use when they are released
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.closed = True
+            for idle in self.idle.values():
+                while not idle.empty():
+                    try:
+                        idle.get_nowait().close()
+                    except Exception:
+                        pass
+        return
+
+
+class Local:
+    #One connection per thread and process to a small SQLite file shared by every web worker,
+    #opened on first use in each thread. pragmas run on every new connection
+
+    def __init__(self, location:str, timeout:float=5, pragmas:list[str]=[]):
+        self.location = location
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.local = threading.local()
+
+    def get(self)->sql.Connection:
+        cn = getattr(self.local, "cn", None)
+        if cn is None or self.local.pid != os.getpid():
+            cn = sql.connect(self.location, timeout=self.timeout)
+            for pragma in self.pragmas:
+                cn.execute(f"PRAGMA {pragma};")
+            self.local.cn = cn
+            self.local.pid = os.getpid()
+        return cn
@@ -2,10 +2,12 @@
 #Fernando Lavarreda
 
 import os
+import math
+import time
 import sqlite3 as sql
 from dataclasses import dataclass
-from typing import Iterable, ClassVar
-from datetime import datetime,timedelta
+from typing import Iterable, Iterator, ClassVar, Callable
+from datetime import datetime
 
 
 @dataclass
@@ -49,10 +51,176 @@ def init(location:str):
                                          date TEXT);")
     cursor.execute("INSERT INTO types(type) VALUES('Income'),('Necessity'),('Pleasure'),('Investment'),('Emergency');")
     cn.commit()
+    migrate(cursor)
     cn.close()
     return
 
 
+#Keeps monthly_rollup in sync with records, sign is 1 for inflows, -1 for outflows and 0 otherwise
+ROLLUP_ADD = "INSERT INTO monthly_rollup(month, type, sign, total, records)\
+              VALUES(strftime('%Y-%m', NEW.date), NEW.type, (NEW.amount>0)-(NEW.amount<0), NEW.amount, 1)\
+              ON CONFLICT(month, type, sign) DO UPDATE SET total=total+excluded.total, records=records+1;"
+ROLLUP_REMOVE = "UPDATE monthly_rollup SET total=total-OLD.amount, records=records-1\
+                 WHERE month=strftime('%Y-%m', OLD.date) AND type IS OLD.type AND sign=(OLD.amount>0)-(OLD.amount<0);\
+                 DELETE FROM monthly_rollup\
+                 WHERE month=strftime('%Y-%m', OLD.date) AND type IS OLD.type AND sign=(OLD.amount>0)-(OLD.amount<0) AND records<=0;"
+
+
+def create_rollup(cursor:sql.Cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS monthly_rollup(\
+                                         month TEXT,\
+                                         type INTEGER,\
+                                         sign INTEGER,\
+                                         total REAL,\
+                                         records INTEGER,\
+                                         PRIMARY KEY(month, type, sign));")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS rollup_insert AFTER INSERT ON records BEGIN {ROLLUP_ADD} END;")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS rollup_delete AFTER DELETE ON records BEGIN {ROLLUP_REMOVE} END;")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS rollup_update AFTER UPDATE OF type, amount, date ON records\
+                     BEGIN {ROLLUP_REMOVE} {ROLLUP_ADD} END;")
+    return
+
+
+def rebuild_rollup(cursor:sql.Cursor):
+    cursor.execute("DROP TABLE IF EXISTS monthly_rollup;")
+    create_rollup(cursor)
+    cursor.execute("INSERT INTO monthly_rollup(month, type, sign, total, records)\
+                    SELECT strftime('%Y-%m', date), type, (amount>0)-(amount<0), SUM(amount), COUNT(*) FROM records\
+                    GROUP BY strftime('%Y-%m', date), type, (amount>0)-(amount<0);")
+    return
+
+
+def verify_rollup(cursor:sql.Cursor, tolerance:float=0.005)->list[tuple]:
+    #Rows (month, type, sign, rollup total, rollup records, actual total, actual records) that are out of sync
+    assert has_rollup(cursor), "Database has no monthly rollup, rebuild it first"
+    actual = cursor.execute("SELECT strftime('%Y-%m', date), type, (amount>0)-(amount<0), SUM(amount), COUNT(*) FROM records\
+                             GROUP BY strftime('%Y-%m', date), type, (amount>0)-(amount<0);")
+    actual = {(a[0], a[1], a[2]):(a[3], a[4]) for a in actual}
+    stored = cursor.execute("SELECT month, type, sign, total, records FROM monthly_rollup;")
+    stored = {(s[0], s[1], s[2]):(s[3], s[4]) for s in stored}
+    mismatches = []
+    for key in sorted(set(actual)|set(stored), key=str):
+        total, records = stored.get(key, (None, 0))
+        atotal, arecords = actual.get(key, (None, 0))
+        if records != arecords or abs((total or 0)-(atotal or 0)) > tolerance:
+            mismatches.append((*key, total, records, atotal, arecords))
+    return mismatches
+
+
+def has_rollup(cursor:sql.Cursor)->bool:
+    found = cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='monthly_rollup';")
+    return bool(list(found)[0][0])
+
+
+def add_rollup(cursor:sql.Cursor):
+    if not has_rollup(cursor):
+        rebuild_rollup(cursor)
+    return
+
+
+def add_indexes(cursor:sql.Cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS records_date ON records(date);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS records_type_date ON records(type, date);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS records_amount ON records(amount);")
+    return
+
+
+def create_search(cursor:sql.Cursor)->bool:
+    #Trigram index over descriptions, optional since it depends on SQLite being built with FTS5
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS records_search\
+                        USING fts5(description, content='records', content_rowid='id', tokenize='trigram');")
+    except sql.OperationalError:
+        return False
+    add = "INSERT INTO records_search(rowid, description) VALUES(NEW.id, NEW.description);"
+    remove = "INSERT INTO records_search(records_search, rowid, description) VALUES('delete', OLD.id, OLD.description);"
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS search_insert AFTER INSERT ON records BEGIN {add} END;")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS search_delete AFTER DELETE ON records BEGIN {remove} END;")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS search_update AFTER UPDATE OF description ON records BEGIN {remove} {add} END;")
+    cursor.execute("INSERT INTO records_search(records_search) VALUES('rebuild');")
+    return True
+
+
+def has_search(cursor:sql.Cursor)->bool:
+    found = cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='records_search';")
+    return bool(list(found)[0][0])
+
+
+def add_search(cursor:sql.Cursor):
+    create_search(cursor)
+    return
+
+
+def add_revision(cursor:sql.Cursor):
+    #Counter bumped in the same transaction as every change to records, cached reports are keyed by it.
+    #PRAGMA data_version can't be used, it is only comparable within a single connection
+    cursor.execute("CREATE TABLE IF NOT EXISTS revision(id INTEGER PRIMARY KEY CHECK(id=0), version INTEGER NOT NULL);")
+    cursor.execute("INSERT OR IGNORE INTO revision(id, version) VALUES(0, 0);")
+    bump = "UPDATE revision SET version=version+1 WHERE id=0;"
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS revision_insert AFTER INSERT ON records BEGIN {bump} END;")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS revision_delete AFTER DELETE ON records BEGIN {bump} END;")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS revision_update AFTER UPDATE ON records BEGIN {bump} END;")
+    return
+
+
+def has_revision(cursor:sql.Cursor)->bool:
+    found = cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='revision';")
+    return bool(list(found)[0][0])
+
+
+def bump_revision(cursor:sql.Cursor):
+    #For writes that bypass the records triggers
+    cursor.execute("UPDATE revision SET version=version+1 WHERE id=0;")
+    return
+
+
+def data_version(cursor:sql.Cursor)->int:
+    return list(cursor.execute("SELECT version FROM revision WHERE id=0;"))[0][0]
+
+
+def add_credentials(cursor:sql.Cursor):
+    #Argon2 hashes of a ledger's passwords by level (PASSWORD, PASSWORD2), the default ledger reads them from the environment
+    cursor.execute("CREATE TABLE IF NOT EXISTS credentials(level TEXT PRIMARY KEY, hash TEXT NOT NULL);")
+    return
+
+
+def get_credentials(cursor:sql.Cursor)->dict[str, str]:
+    return {level:hash_ for level, hash_ in cursor.execute("SELECT level, hash FROM credentials;")}
+
+
+def set_credential(cursor:sql.Cursor, level:str, hash_:str):
+    cursor.execute("INSERT INTO credentials(level, hash) VALUES(?,?) ON CONFLICT(level) DO UPDATE SET hash=excluded.hash;", (level, hash_))
+    return
+
+
+#Schema changes in order of application, PRAGMA user_version holds how many have been applied
+MIGRATIONS = [add_rollup, add_indexes, add_search, add_revision, add_credentials]
+
+
+def schema_version(cursor:sql.Cursor)->int:
+    return list(cursor.execute("PRAGMA user_version;"))[0][0]
+
+
+def migrate(cursor:sql.Cursor)->list[str]:
+    #Each migration runs and is committed in its own transaction
+    applied = []
+    version = schema_version(cursor)
+    assert version <= len(MIGRATIONS), f"Database schema version {version} is newer than this application"
+    if cursor.connection.in_transaction:
+        cursor.connection.commit()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version+1):
+        cursor.execute("BEGIN;")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version={number};")
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            raise
+        cursor.execute("COMMIT;")
+        applied.append(migration.__name__)
+    return applied
+
+
 def insert(cursor:sql.Cursor, records:list[Record]):
     cursor.executemany("INSERT INTO records(type, description, amount, date) VALUES(?,?,?,?);", [(r.type_, r.description, r.amount, r.date) for r in records])
     return
@@ -64,6 +232,43 @@ def delete(cursor:sql.Cursor, **kwargs):
     return 
 
 
+def delete_preview(cursor:sql.Cursor, limit:int=10, **kwargs)->tuple[int, list[tuple]]:
+    #Number of records a delete with the same filters removes and the newest few of them, nothing is written
+    rows = [r[:4] for r in page(cursor, size=limit, **kwargs)][:limit]
+    return get_count(cursor, **kwargs), rows
+
+
+def delete_chunked(cursor:sql.Cursor, chunk:int=5000, pause:float=0.01, progress:Callable[[int], None]=None, **kwargs)->int:
+    #Deletes the records matching when it starts in transactions of at most chunk records, each over a range of ids,
+    #so the write lock is held briefly and other writers get it in the pause between chunks (waiting writers poll for it).
+    #The triggers keep the rollup, search index and revision in step with every committed chunk. progress is called
+    #with the records deleted so far
+    assert chunk > 0, "Chunk size must be positive"
+    pred, params = apply_filters(cursor=cursor, **kwargs)
+    if cursor.connection.in_transaction:
+        cursor.connection.commit()
+    ranges = []
+    for count, (id_,) in enumerate(cursor.execute(f"SELECT records.id FROM records {pred} ORDER BY records.id;", params)):
+        if count%chunk == 0:
+            ranges.append([id_, id_])
+        else:
+            ranges[-1][1] = id_
+    pred = (pred+" AND " if pred else "WHERE ")+"records.id BETWEEN ? AND ?"
+    deleted = 0
+    for low, high in ranges:
+        try:
+            cursor.execute(f"DELETE FROM records {pred};", params+[low, high])
+            deleted+=cursor.rowcount
+        except Exception:
+            cursor.connection.rollback()
+            raise
+        cursor.connection.commit()
+        if progress:
+            progress(deleted)
+        time.sleep(pause)
+    return deleted
+
+
 def load(data:Iterable[str], types:dict[str, int], delimiter:str=",")->list[Record]:
     records = []
     for line in data:
@@ -81,12 +286,36 @@ def peek(cursor:sql.Cursor, limit:int=30)->list[list[str]]:
     records = []
     if limit == -1:
         records = cursor.execute("SELECT types.type, records.description, records.amount, records.date FROM records\
-                                  LEFT JOIN types ON records.type=types.id ORDER BY records.date DESC;")
+                                  LEFT JOIN types ON records.type=types.id ORDER BY records.date DESC, records.id DESC;")
     elif limit > 0:
         records = cursor.execute("SELECT types.type, records.description, records.amount, records.date FROM records\
-                                  LEFT JOIN types ON records.type=types.id ORDER BY records.date DESC LIMIT ?;", (limit,))
+                                  LEFT JOIN types ON records.type=types.id ORDER BY records.date DESC, records.id DESC LIMIT ?;", (limit,))
     return list(records)
-    
+
+
+def page(cursor:sql.Cursor, size:int=30, after:tuple[str, int]=None, **kwargs)->sql.Cursor:
+    #Records newest first after the (date, id) key of the last record of the previous page, seeking the date
+    #index to the key keeps every page as cheap as the first. Rows end with the id and come lazily from the cursor,
+    #up to size+1 of them, the extra one only tells a next page exists
+    assert size > 0, "Page size must be positive"
+    pred, params = apply_filters(cursor=cursor, **kwargs)
+    if after:
+        pred = (pred+" AND " if pred else "WHERE ")+"(records.date, records.id)<(?,?)"
+        params = params+list(after)
+    return cursor.execute(f"SELECT types.type, records.description, records.amount, records.date, records.id FROM records\
+                            LEFT JOIN types ON records.type=types.id {pred} ORDER BY records.date DESC, records.id DESC LIMIT ?;", params+[size+1])
+
+
+def export(cursor:sql.Cursor, size:int=1000)->Iterator[list[tuple]]:
+    #Same rows as peek(limit=-1), stepped lazily in batches of size
+    cursor.execute("SELECT types.type, records.description, records.amount, records.date FROM records\
+                    LEFT JOIN types ON records.type=types.id ORDER BY records.date DESC, records.id DESC;")
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
 
 def get_types(cursor:sql.Cursor)->dict[str, int]:
     rs = cursor.execute("SELECT id,type FROM types")
@@ -141,8 +370,13 @@ def type_predicate(types:dict, type_:str=""):
     return "", params
 
 
-def description_predicate(description:str=""):
+def description_predicate(description:str="", search:bool=False):
+    #The trigram index needs at least 3 characters and knows nothing about LIKE wildcards
     params = []
+    if description and search and len(description) >= 3 and not set(description)&{"%", "_"}:
+        predicate = "records.id IN (SELECT rowid FROM records_search WHERE records_search MATCH ?)"
+        params.append('"'+description.replace('"', '""')+'"')
+        return predicate, params
     if description:
         predicate = f"description LIKE '%' ||?|| '%'"
         params.append(description)
@@ -150,15 +384,16 @@ def description_predicate(description:str=""):
     return "", params
 
 
-def apply_filters(*, cursor:sql.Cursor=None, select:str="", type_:str="", description:str="", start:datetime=None, end:datetime=None):
-    if cursor:
+def apply_filters(*, cursor:sql.Cursor=None, types:dict[str, int]=None, select:str="", type_:str="", description:str="", start:datetime=None, end:datetime=None):
+    if types is None and cursor:
         types = get_types(cursor)
-    else:
+    elif types is None:
         types = {"No cursor provided":-1}
     se_pred, _ = select_predicate(select)
     date_pred, date_params = date_predicate(start, end)
     typ_pred, typ_params  = type_predicate(types, type_)
-    desc_pred, desc_params  = description_predicate(description)
+    search = bool(description) and bool(cursor) and has_search(cursor)
+    desc_pred, desc_params  = description_predicate(description, search)
     predicate = [pred for pred in (se_pred, date_pred, typ_pred, desc_pred) if pred]
     params = date_params+typ_params+desc_params
     if predicate:
@@ -174,38 +409,148 @@ def daily_flow(cursor, **kwargs):
     return list(total)
 
 
+def fill_months(flows:list[tuple[str, float]], force_end_date:datetime=None)->list[tuple[str, float]]:
+    #Required since it's possible a month may not register any transactions.
+    #resample loads numpy, it's imported where used so starting the app doesn't
+    import resample
+    return resample.resample(flows, "month", end=force_end_date)
+
+
+def accumulate(flows:list[tuple[str, float]])->list[tuple[str, float]]:
+    import resample
+    return resample.cumulative(flows)
+
+
+def mean(data:list[float]):
+    if data:
+        return sum(data)/len(data)
+    return None
+
+
+def variance(data:list[float]):
+    if data:
+        mean_ = sum(data)/len(data)
+        return sum([(d-mean_)**2 for d in data])/len(data)
+    return None
+
+
+def median(data:list[float], ordered:bool=False):
+    if not data:
+        return None
+    if not ordered:
+        data = sorted(data)
+    if len(data)%2:
+        return data[len(data)//2]
+    left = len(data)//2-1
+    right = len(data)//2
+    return (data[left]+data[right])/2
+
+
+def quantile(data:list[float], q:float, ordered:bool=False):
+    #Linear interpolation between the closest ranks
+    if not data:
+        return None
+    if not ordered:
+        data = sorted(data)
+    position = (len(data)-1)*q
+    low = math.floor(position)
+    high = min(low+1, len(data)-1)
+    return data[low]+(data[high]-data[low])*(position-low)
+
+
+class Variance:
+    #Population variance in one pass, Welford's update keeps it stable for large amounts
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.count+=1
+        delta = value-self.mean
+        self.mean+=delta/self.count
+        self.m2+=delta*(value-self.mean)
+        return
+
+    def finalize(self):
+        if not self.count:
+            return None
+        return self.m2/self.count
+
+
+class Deviation(Variance):
+    def finalize(self):
+        if not self.count:
+            return None
+        return math.sqrt(self.m2/self.count)
+
+
+class Median:
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+        return
+
+    def finalize(self):
+        return median(self.values)
+
+
+class Quantile(Median):
+    def __init__(self):
+        super().__init__()
+        self.q = None
+
+    def step(self, value, q):
+        assert 0 <= q <= 1, "Quantile must be between 0 and 1"
+        self.q = q
+        super().step(value)
+        return
+
+    def finalize(self):
+        return quantile(self.values, self.q)
+
+
+AGGREGATES = {"var_pop":(Variance, 1), "stddev_pop":(Deviation, 1), "median":(Median, 1), "quantile":(Quantile, 2)}
+
+
+def register(cn:sql.Connection):
+    #Statistics as SQL aggregates, cheap enough to register again on every use of a connection
+    for name, (aggregate, args) in AGGREGATES.items():
+        cn.create_aggregate(name, args, aggregate)
+    return
+
+
+def rollup_flow(cursor, select:str="", type_:str=""):
+    #Monthly flows read from monthly_rollup, only valid for selection and type filters
+    signs = {"positive":"sign=1", "negative":"sign=-1", "all":""}
+    select_predicate(select)
+    typ_pred, params = type_predicate(get_types(cursor), type_)
+    predicate = [pred for pred in (signs.get(select, ""), typ_pred.replace("records.", "")) if pred]
+    if predicate:
+        predicate = "WHERE "+" AND ".join(predicate)
+    else:
+        predicate = ""
+    total = cursor.execute(f"SELECT month,SUM(total) FROM monthly_rollup {predicate} GROUP BY month HAVING SUM(records)>0 ORDER BY month;", params)
+    return list(total)
+
+
 def monthly_flow(cursor, force_end_date:datetime=None, **kwargs):
-    #Required since it's possible a month may not register any transactions
+    if not any(kwargs.get(k) for k in ("description", "start", "end")) and has_rollup(cursor):
+        flows = rollup_flow(cursor, select=kwargs.get("select", ""), type_=kwargs.get("type_", ""))
+        return fill_months(flows, force_end_date)
     pred, params = apply_filters(cursor=cursor, **kwargs)
     total = cursor.execute(f"SELECT strftime('%Y-%m', records.date),SUM(amount) FROM records {pred} GROUP BY strftime('%Y-%m', records.date) ORDER BY records.date;", params)
-    flows = list(total)
-    actual_flows = []
-    if flows:
-        start_date = datetime.strptime(flows[0][0], "%Y-%m")
-        if type(force_end_date) != type(None):
-            end_date = force_end_date
-            assert end_date >= start_date, f"Forced end date must be equal or greater than start date"
-        else:
-            end_date = datetime.strptime(flows[-1][0], "%Y-%m")
-        month_value = {flow[0]:flow[1] for flow in flows}
-        actual_flows.append((flows[0][0], flows[0][1]))
-        while start_date.year != end_date.year or start_date.month != end_date.month:
-            start_date+=timedelta(days=31)
-            start_date = start_date-timedelta(days=start_date.day-1)
-            fm = start_date.strftime("%Y-%m")
-            val = 0
-            if fm in month_value:
-                val = month_value[fm]
-            actual_flows.append((fm,val))
-    return actual_flows
+    return fill_months(list(total), force_end_date)
 
 
 def monthly_flow_mean(cursor, force_end_date:datetime=None, **kwargs):
-    mean = None
     mflow = monthly_flow(cursor, force_end_date=force_end_date, **kwargs)
-    if mflow:
-        mean = sum([m[1] for m in mflow])/len(mflow)
-    return mean
+    return mean([m[1] for m in mflow])
 
 
 def monthly_flow_max(cursor, force_end_date:datetime=None, **kwargs):
@@ -226,12 +571,7 @@ def monthly_flow_min(cursor, force_end_date:datetime=None, **kwargs):
 
 def monthly_flow_var(cursor, force_end_date:datetime=None, **kwargs):
     mflow = monthly_flow(cursor, force_end_date=force_end_date, **kwargs)
-    var = None
-    if mflow:
-        data = [m[1] for m in mflow]
-        mean = sum(data)/len(data)
-        var = sum([(d-mean)**2 for d in data])/len(data)
-    return var
+    return variance([m[1] for m in mflow])
 
 
 def monthly_flow_sd(cursor, force_end_date:datetime=None, **kwargs):
@@ -243,29 +583,61 @@ def monthly_flow_sd(cursor, force_end_date:datetime=None, **kwargs):
 
 
 def monthly_flow_median(cursor, force_end_date:datetime=None, **kwargs):
-    median = None
     mflow = monthly_flow(cursor, force_end_date=force_end_date, **kwargs)
-    if mflow:
-        data = sorted([m[1] for m in mflow])
-        if len(mflow)%2:
-            index = len(data)//2
-            median = data[index]
-        else:
-            left = len(data)//2-1
-            right = len(data)//2
-            median = (data[left]+data[right])/2
-    return median
+    return median([m[1] for m in mflow])
 
 
-def cumulative(cursor, **kwargs):
-    records = monthly_flow(cursor, **kwargs)
-    acumulated = []
-    if records:
-        acumulated.append(records[0])
-        for record in records[1:]:
-            updated = (record[0], record[1]+acumulated[-1][1])
-            acumulated.append(updated)
-    return acumulated
+def flow(cursor, period:str="month", force_end_date:datetime=None, **kwargs):
+    #Flows per day, week, month, quarter or year with empty periods filled in
+    if period == "month":
+        return monthly_flow(cursor, force_end_date=force_end_date, **kwargs)
+    pred, params = apply_filters(cursor=cursor, **kwargs)
+    total = cursor.execute(f"SELECT date(records.date),SUM(amount) FROM records {pred} GROUP BY date(records.date) ORDER BY date(records.date);", params)
+    import resample
+    return resample.resample(list(total), period, end=force_end_date)
+
+
+def balances(cursor, period:str="month", by_type:bool=False, force_end_date:datetime=None, **kwargs)->dict[str, list[tuple[str, float]]]:
+    #Running balances at the close of every period of the net flow ("all"), inflows ("positive") and outflows ("negative"),
+    #and of each type by name with by_type. One query sums the totals of each day over windows, for months and longer
+    #periods without date or description filters the monthly rollup stands in for the records
+    types = get_types(cursor)
+    names = {id_:type_ for type_, id_ in types.items()}
+    if period in ("month", "quarter", "year") and not any(kwargs.get(k) for k in ("description", "start", "end", "select")) and has_rollup(cursor):
+        day, type_, amount, inflow, outflow = "month", "type", "total", "sign=1", "sign=-1"
+        typ_pred, params = type_predicate(types, kwargs.get("type_", ""))
+        source = "monthly_rollup "+("WHERE "+typ_pred.replace("records.", "") if typ_pred else "")
+        having = "HAVING SUM(records)>0"
+    else:
+        day, type_, amount, inflow, outflow = "records.date", "records.type", "amount", "amount>0", "amount<0"
+        pred, params = apply_filters(cursor=cursor, types=types, **kwargs)
+        source = "records "+pred
+        having = ""
+    #Types split the days only when their balances are wanted
+    group = f"{day}, {type_}" if by_type else day
+    typed = f"{type_}, SUM(SUM({amount})) OVER (PARTITION BY {type_} ORDER BY {day})" if by_type else "NULL, NULL"
+    rows = cursor.execute(f"SELECT {day}, SUM(SUM({amount})) OVER w, SUM(SUM(CASE WHEN {inflow} THEN {amount} ELSE 0 END)) OVER w,\
+                            SUM(SUM(CASE WHEN {outflow} THEN {amount} ELSE 0 END)) OVER w, {typed} FROM {source}\
+                            GROUP BY {group} {having} WINDOW w AS (ORDER BY {day}) ORDER BY {day};", params)
+    series = {"all":[], "positive":[], "negative":[]}
+    if by_type:
+        series.update({name:[] for name in types})
+    for date, net, positive, negative, id_, balance in rows:
+        series["all"].append((date, net))
+        series["positive"].append((date, positive))
+        series["negative"].append((date, negative))
+        if by_type:
+            series[names[id_]].append((date, balance))
+    import resample
+    #Every series spans the periods of the net flow, types without records yet are at 0
+    start, end = (series["all"][0][0], series["all"][-1][0]) if series["all"] else (None, None)
+    end = force_end_date or end
+    return {name:resample.carry(values, period, start=start, end=end) for name, values in series.items()}
+
+
+def cumulative(cursor, period:str="month", select:str="all", force_end_date:datetime=None, **kwargs):
+    select_predicate(select)
+    return balances(cursor, period, force_end_date=force_end_date, **kwargs)[select or "all"]
 
 
 def sum_sign(cursor, **kwargs):
@@ -286,6 +658,14 @@ def get_min(cursor, limit=1, **kwargs):
     return list(total)
     
 
+def get_stats(cursor, **kwargs)->dict:
+    #Count, sum, mean, median and standard deviation of the amounts in a single scan
+    register(cursor.connection)
+    pred, params = apply_filters(cursor=cursor, **kwargs)
+    total = cursor.execute(f"SELECT COUNT(amount),SUM(amount),AVG(amount),median(amount),stddev_pop(amount) FROM records {pred};", params)
+    return dict(zip(["count", "sum", "mean", "median", "std"], list(total)[0]))
+
+
 def get_avg(cursor, **kwargs):
     pred, params = apply_filters(cursor=cursor, **kwargs)
     total = cursor.execute(f"SELECT SUM(amount)/COUNT(amount) FROM records {pred};", params)
@@ -294,13 +674,15 @@ def get_avg(cursor, **kwargs):
 
 def get_var(cursor, **kwargs):
     pred, params = apply_filters(cursor=cursor, **kwargs)
-    total = cursor.execute(f"SELECT SUM(pow(amount,2))/COUNT(amount)-pow(SUM(amount)/COUNT(amount),2) FROM records {pred};", params)
+    register(cursor.connection)
+    total = cursor.execute(f"SELECT var_pop(amount) FROM records {pred};", params)
     return list(total)[0][0]
 
 
 def get_std(cursor, **kwargs):
     pred, params = apply_filters(cursor=cursor, **kwargs)
-    total = cursor.execute(f"SELECT sqrt(SUM(pow(amount,2))/COUNT(amount)-pow(SUM(amount)/COUNT(amount),2)) FROM records {pred};", params)
+    register(cursor.connection)
+    total = cursor.execute(f"SELECT stddev_pop(amount) FROM records {pred};", params)
     return list(total)[0][0]
 
 
@@ -311,19 +693,14 @@ def get_count(cursor, **kwargs):
 
 
 def get_median(cursor, **kwargs):
+    register(cursor.connection)
     pred, params = apply_filters(cursor=cursor, **kwargs)
-    total = cursor.execute(f"SELECT COUNT(amount) FROM records {pred};", params)
-    total = list(total)[0][0]
-    if total:
-        if total%2:
-            mid = total//2
-            total = list(cursor.execute(f"SELECT amount FROM records {pred} ORDER BY amount LIMIT 1 OFFSET ?;", params+[mid,]))[0][0]
-        else:
-            mid1 = total//2-1
-            mid2 = total//2
-            m1 = list(cursor.execute(f"SELECT amount FROM records {pred} ORDER BY amount LIMIT 1 OFFSET ?;", params+[mid1,]))[0][0]
-            m2 = list(cursor.execute(f"SELECT amount FROM records {pred} ORDER BY amount LIMIT 1 OFFSET ?;", params+[mid2,]))[0][0]
-            total = (m1+m2)/2
-    else:
-        total = None
-    return total
+    total = cursor.execute(f"SELECT median(amount) FROM records {pred};", params)
+    return list(total)[0][0]
+
+
+def get_quantile(cursor, q:float, **kwargs):
+    register(cursor.connection)
+    pred, params = apply_filters(cursor=cursor, **kwargs)
+    total = cursor.execute(f"SELECT quantile(amount, ?) FROM records {pred};", [q,]+params)
+    return list(total)[0][0]
@@ -1,6 +1,7 @@
 #!./venv/bin/python3
 #Fernando Lavarreda
 
+import metrics
 import numpy as np
 from datetime import datetime
 import matplotlib.pyplot as plt
@@ -40,7 +41,9 @@ def mseries(records:list[list[datetime, float]], *, save:str="", labels:list[str
     ax.set_xlabel("Date")
     ax.set_ylabel("Money")
     fig.tight_layout()
-    fig.savefig(save)
+    with metrics.phase("graph.mseries.save"):
+        fig.savefig(save)
+    plt.close(fig)
     return save
 
 
@@ -74,7 +77,9 @@ def series(records:list[datetime, float], save:str, color:str="blue", absolute:b
     ax.set_xlabel("Date")
     ax.set_ylabel("Money")
     fig.tight_layout()
-    fig.savefig(save)
+    with metrics.phase("graph.series.save"):
+        fig.savefig(save)
+    plt.close(fig)
     return save
 
 
@@ -104,7 +109,9 @@ def bar(xs:list[str], ins:list[float], out:list[float], save:str,\
     ax.set_ylim(0, max(ins+out)*1.05)
     ax.legend(loc="upper right")
     fig.tight_layout()
-    fig.savefig(save)
+    with metrics.phase("graph.bar.save"):
+        fig.savefig(save)
+    plt.close(fig)
     return save
 
 
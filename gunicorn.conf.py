@@ -0,0 +1,35 @@
+#Fernando Lavarreda
+#gunicorn settings: gunicorn -c gunicorn.conf.py
+
+import os
+import time
+
+
+wsgi_app = "main:create_app()"
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+preload_app = True
+
+
+def on_starting(server):
+    #Database migrations and chart backend imports happen once in the master, before forking workers
+    started = time.perf_counter()
+    import main
+    main.warmup()
+    server.log.info(f"Warm up done in {(time.perf_counter()-started)*1000:.1f} ms")
+
+
+def post_fork(server, worker):
+    worker.forked = time.perf_counter()
+    #Render processes are spawned, not forked, so they import the chart backend now instead of on the first report
+    import charts
+    charts.warm()
+
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} cold start: {(time.perf_counter()-worker.forked)*1000:.1f} ms")
+
+
+def worker_exit(server, worker):
+    import main
+    main.shutdown()
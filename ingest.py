@@ -0,0 +1,162 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Streaming import of Type|Description|Amount|Date files
+
+import re
+import sqlite3 as sql
+import database as db
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, ClassVar, Callable
+
+
+HEADER = "type|description|amount|date"
+
+
+@dataclass
+class Report:
+    #Only the first MAX_ERRORS rejected lines are kept, all of them are counted
+    MAX_ERRORS:ClassVar = 100
+    lines:int = 0
+    inserted:int = 0
+    rejected:int = 0
+    errors:list[tuple[int, str]] = field(default_factory=list)
+
+    def reject(self, number:int, error:str):
+        self.rejected+=1
+        if len(self.errors) < Report.MAX_ERRORS:
+            self.errors.append((number, error))
+        return
+
+
+#Dates in the only layout numpy and strptime/strftime agree on, anything else goes through strptime
+DATE = re.compile(r"[1-9][0-9]{3}-[0-9]{2}-[0-9]{2}")
+
+
+@dataclass
+class Maps:
+    #Conversions of raw type and date fields already seen during an import, invalid ones map to None
+    MAX_ENTRIES:ClassVar = 100000
+    types:dict[str, int]
+    kinds:dict[str, int] = field(default_factory=dict)
+    dates:dict[str, str] = field(default_factory=dict)
+
+
+def convert_kinds(raw:list[str], maps:Maps)->list[int]:
+    if len(maps.kinds) > Maps.MAX_ENTRIES:
+        maps.kinds.clear()
+    for kind in set(raw)-maps.kinds.keys():
+        maps.kinds[kind] = maps.types.get(kind.title())
+    return [maps.kinds[kind] for kind in raw]
+
+
+def convert_dates(raw:list[str], maps:Maps)->list[str]:
+    if len(maps.dates) > Maps.MAX_ENTRIES:
+        maps.dates.clear()
+    new = set(raw)-maps.dates.keys()
+    strict = [d for d in new if DATE.fullmatch(d)]
+    if strict:
+        import numpy as np
+        try:
+            maps.dates.update(zip(strict, np.array(strict, dtype="datetime64[D]").astype(str).tolist()))
+        except ValueError:
+            pass
+    for date in new:
+        if date not in maps.dates:
+            try:
+                maps.dates[date] = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d")
+            except ValueError:
+                maps.dates[date] = None
+    return [maps.dates[d] for d in raw]
+
+
+def convert_amounts(raw:list[str])->list[float]:
+    import numpy as np
+    try:
+        return np.array(raw, dtype=np.float64).tolist()
+    except ValueError:
+        pass
+    amounts = []
+    for amount in raw:
+        try:
+            amounts.append(float(amount))
+        except ValueError:
+            amounts.append(None)
+    return amounts
+
+
+def convert(rows:list[tuple[int, str, list[str]]], maps:Maps, report:Report)->Iterator[db.Record]:
+    #Same records and error messages as create_record, checked in the same order, for a whole batch of lines
+    kinds = convert_kinds([r[2][0] for r in rows], maps)
+    amounts = convert_amounts([r[2][2] for r in rows])
+    dates = convert_dates([r[2][3] for r in rows], maps)
+    for (number, line, args), kind, amount, date in zip(rows, kinds, amounts, dates):
+        description = args[1]
+        if description.strip() == "":
+            error = "Cannot enter empty description"
+        elif amount is None:
+            error = "Amount must be a real number"
+        elif date is None:
+            error = "Date must be formatted as YYYY-MM-DD"
+        elif kind is None:
+            error = f"Type must be: {','.join(list(maps.types.keys()))}"
+        else:
+            yield db.Record(kind, description[:db.Record.CLIMIT].strip(), amount, date)
+            continue
+        report.reject(number, f"{error} for record: {line}")
+    return
+
+
+def parse(lines:Iterable[str], types:dict[str, int], report:Report, delimiter:str="|", batch:int=5000)->Iterator[db.Record]:
+    maps = Maps(types)
+    rows = []
+    number = 0
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or (number == 1 and line.lower() == HEADER.replace("|", delimiter)):
+            continue
+        args = line.split(delimiter)
+        if len(args) != 4:
+            report.reject(number, f"Expected 4 fields Type{delimiter}Description{delimiter}Amount{delimiter}Date for record: {line}")
+            continue
+        rows.append((number, line, args))
+        if len(rows) >= batch:
+            report.lines = number
+            yield from convert(rows, maps, report)
+            rows = []
+    report.lines = number
+    if rows:
+        yield from convert(rows, maps, report)
+    return
+
+
+def chunks(records:Iterable[db.Record], size:int)->Iterator[list[db.Record]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    return
+
+
+def ingest(cn:sql.Connection, lines:Iterable[str], delimiter:str="|", chunk:int=5000, progress:Callable[[Report], None]=None)->Report:
+    #Lines are read lazily and inserted in transactions of at most chunk records,
+    #so memory stays bounded and other writers get the lock between chunks.
+    #progress is called with the report after every committed chunk
+    report = Report()
+    cursor = cn.cursor()
+    types = db.get_types(cursor)
+    for records in chunks(parse(lines, types, report, delimiter, batch=chunk), chunk):
+        try:
+            db.insert(cursor, records)
+        except Exception:
+            cn.rollback()
+            raise
+        cn.commit()
+        report.inserted+=len(records)
+        if progress:
+            progress(report)
+    return report
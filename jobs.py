@@ -0,0 +1,179 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Queue of file imports run in background threads. Uploads are spooled to a directory and the jobs are
+#kept in a SQLite file there, so any web worker can run a job and report the status of any job
+
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import ingest
+import connections
+import threading
+import sqlite3 as sql
+from typing import BinaryIO
+
+
+class Interrupted(Exception):
+    pass
+
+
+class Queue:
+
+    def __init__(self, directory:str, workers:int=1, chunk:int=5000, poll:float=2, ttl:int=604800):
+        #Finished jobs are forgotten after ttl seconds
+        assert workers > 0, "At least one thread must run imports"
+        self.directory = directory
+        self.workers = workers
+        self.chunk = chunk
+        self.poll = poll
+        self.ttl = ttl
+        self.connection = connections.Local(os.path.join(directory, "jobs.db"), 30, ["journal_mode=WAL"])
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop = threading.Event()
+        self.threads = []
+        self.pid = None
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        cn = self.connection.get()
+        cn.execute("CREATE TABLE IF NOT EXISTS jobs(\
+                                         id TEXT PRIMARY KEY,\
+                                         ledger TEXT,\
+                                         database TEXT,\
+                                         delimiter TEXT,\
+                                         status TEXT,\
+                                         lines INTEGER DEFAULT 0,\
+                                         inserted INTEGER DEFAULT 0,\
+                                         rejected INTEGER DEFAULT 0,\
+                                         errors TEXT DEFAULT '[]',\
+                                         error TEXT,\
+                                         created REAL,\
+                                         started REAL,\
+                                         updated REAL,\
+                                         finished REAL);")
+        cn.commit()
+
+    def spool(self, id_:str)->str:
+        return os.path.join(self.directory, f"{id_}.upload")
+
+    def submit(self, database:str, stream:BinaryIO, ledger:str="", delimiter:str="|")->str:
+        #Copies the upload to disk and returns the job id, the import itself runs in the background
+        id_ = uuid.uuid4().hex
+        with open(self.spool(id_), "wb") as fd:
+            shutil.copyfileobj(stream, fd, 1<<20)
+        now = time.time()
+        cn = self.connection.get()
+        cn.execute("INSERT INTO jobs(id, ledger, database, delimiter, status, created, updated) VALUES(?,?,?,?,'queued',?,?);",\
+                   (id_, ledger, database, delimiter, now, now))
+        cn.execute("DELETE FROM jobs WHERE finished<?;", (now-self.ttl,))
+        cn.commit()
+        self.start()
+        self.wake.set()
+        return id_
+
+    def status(self, id_:str)->dict:
+        #Also resumes jobs queued before a restart
+        self.start()
+        cn = self.connection.get()
+        found = list(cn.execute("SELECT id, ledger, status, lines, inserted, rejected, errors, error, created, started, updated, finished\
+                                 FROM jobs WHERE id=?;", (id_,)))
+        if not found:
+            return None
+        job = dict(zip(["id", "ledger", "status", "lines", "inserted", "rejected", "errors", "error",\
+                        "created", "started", "updated", "finished"], found[0]))
+        job["errors"] = json.loads(job["errors"])
+        elapsed = (job["finished"] or job["updated"])-(job["started"] or job["updated"])
+        job["lines_per_second"] = round(job["lines"]/elapsed, 1) if elapsed > 0 else None
+        return job
+
+    def claim(self)->tuple:
+        cn = self.connection.get()
+        now = time.time()
+        found = list(cn.execute("UPDATE jobs SET status='running', started=?, updated=?\
+                                 WHERE id=(SELECT id FROM jobs WHERE status='queued' ORDER BY created LIMIT 1)\
+                                 RETURNING id, database, delimiter;", (now, now)))
+        cn.commit()
+        return found[0] if found else None
+
+    def update(self, id_:str, report:ingest.Report, status:str="running", error:str=None):
+        if self.stop.is_set() and status == "running":
+            raise Interrupted("Server stopped")
+        now = time.time()
+        finished = now if status != "running" else None
+        cn = self.connection.get()
+        cn.execute("UPDATE jobs SET status=?, lines=?, inserted=?, rejected=?, errors=?, error=?, updated=?, finished=? WHERE id=?;",\
+                   (status, report.lines, report.inserted, report.rejected, json.dumps(report.errors), error, now, finished, id_))
+        cn.commit()
+        return
+
+    def process(self, id_:str, database:str, delimiter:str):
+        report = ingest.Report()
+        status, error = "done", None
+        try:
+            cn = sql.connect(database, timeout=30)
+            try:
+                with open(self.spool(id_), "rb") as fd:
+                    lines = io.TextIOWrapper(fd, encoding="utf-8", errors="replace")
+                    report = ingest.ingest(cn, lines, delimiter=delimiter, chunk=self.chunk,\
+                                           progress=lambda r: self.update(id_, r))
+            finally:
+                cn.close()
+        except Interrupted as e:
+            status, error = "failed", str(e)
+        except Exception as e:
+            status, error = "failed", f"Could not process file: {e}"
+        self.update(id_, report, status, error)
+        try:
+            os.remove(self.spool(id_))
+        except OSError:
+            pass
+        return
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                job = self.claim()
+            except sql.Error:
+                job = None
+            if job is None:
+                self.wake.wait(self.poll)
+                self.wake.clear()
+                continue
+            self.process(*job)
+        return
+
+    def start(self):
+        #Threads don't survive fork, every web worker starts its own on its first request
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stop.clear()
+            self.threads = [threading.Thread(target=self.run, name=f"import-{i}", daemon=True) for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+        return
+
+    def recover(self)->int:
+        #Jobs left running by a server that stopped, their committed chunks stay in the database
+        cn = self.connection.get()
+        cur = cn.execute("UPDATE jobs SET status='failed', error='Interrupted, server stopped', finished=? WHERE status='running';", (time.time(),))
+        cn.commit()
+        return cur.rowcount
+
+    def shutdown(self, timeout:float=5):
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.stop.set()
+            self.wake.set()
+            for thread in self.threads:
+                thread.join(timeout)
+            self.threads = []
+            self.pid = None
+        return
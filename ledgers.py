@@ -0,0 +1,110 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Many ledgers served by one deployment, each one a SQLite file in a directory with its own passwords.
+#Ledgers are opened on first use and the least recently used ones are closed past a number of open ledgers
+
+import os
+import re
+import threading
+import connections
+import sqlite3 as sql
+import database as db
+from dataclasses import dataclass
+from collections import OrderedDict
+
+
+NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+@dataclass
+class Ledger:
+    name:str
+    pool:connections.Pool
+
+    def credentials(self)->dict[str, str]:
+        #Read on every login so passwords changed with manage.py apply to running servers
+        with self.pool.connection(readonly=True) as cn:
+            return db.get_credentials(cn.cursor())
+
+
+class Router:
+
+    def __init__(self, directory:str, capacity:int=64, **options):
+        #options are passed to every connections.Pool
+        assert capacity > 0, "At least one ledger must be kept open"
+        self.directory = directory
+        self.capacity = capacity
+        self.options = options
+        self.ledgers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def location(self, name:str)->str:
+        if not NAME.fullmatch(name):
+            raise ValueError(f"Invalid ledger name: '{name}'")
+        return os.path.join(self.directory, name+".db")
+
+    def exists(self, name:str)->bool:
+        return os.path.isfile(self.location(name))
+
+    def open(self, name:str)->Ledger:
+        location = self.location(name)
+        if not os.path.isfile(location):
+            raise LookupError(f"No ledger named '{name}'")
+        #Ledgers created by an older version are brought up to date on first use
+        cn = sql.connect(location)
+        try:
+            cur = cn.cursor()
+            db.migrate(cur)
+            cn.execute("PRAGMA journal_mode=WAL;")
+        finally:
+            cn.close()
+        return Ledger(name, connections.Pool(location, **self.options))
+
+    def get(self, name:str)->Ledger:
+        with self.lock:
+            if name in self.ledgers:
+                self.ledgers.move_to_end(name)
+                return self.ledgers[name]
+        ledger = self.open(name)
+        with self.lock:
+            if name in self.ledgers:
+                #Opened by another thread meanwhile
+                ledger.pool.close()
+                self.ledgers.move_to_end(name)
+                return self.ledgers[name]
+            self.ledgers[name] = ledger
+            while len(self.ledgers) > self.capacity:
+                _, evicted = self.ledgers.popitem(last=False)
+                evicted.pool.close()
+        return ledger
+
+    def create(self, name:str, credentials:dict[str, str]):
+        #New ledger or new passwords for an existing one
+        location = self.location(name)
+        if not os.path.isfile(location):
+            db.init(location)
+        cn = sql.connect(location)
+        try:
+            cur = cn.cursor()
+            db.migrate(cur)
+            for level, hash_ in credentials.items():
+                db.set_credential(cur, level, hash_)
+            cn.commit()
+        finally:
+            cn.close()
+        self.forget(name)
+        return
+
+    def forget(self, name:str):
+        with self.lock:
+            ledger = self.ledgers.pop(name, None)
+        if ledger:
+            ledger.pool.close()
+        return
+
+    def close(self):
+        with self.lock:
+            for ledger in self.ledgers.values():
+                ledger.pool.close()
+            self.ledgers.clear()
+        return
@@ -4,224 +4,460 @@
 
 import os
 import sys
-import shutil
+import time
+import auth
+import jobs
+import cProfile
+import metrics
+import cache
+import atexit
+import charts
+import ingest
+import ledgers
+import connections
 import render
 import read_inputs
 import database as db
 import sqlite3 as sql
 from datetime import datetime
-from argon2 import PasswordHasher
-from flask import Flask, render_template, request, redirect, url_for, send_file
+from datetime import timedelta
+from flask import Flask, current_app, render_template, stream_template, request, redirect, url_for, session, g, abort, jsonify, Response
 
 
-app = Flask(__name__)
-passwd = os.environ["DBPASSWORD"]
-passwd2 = os.environ["DBPASSWORD2"]
-DATABASE = os.environ["DATABASE"]
-DATA_SOURCE = os.environ["DATASOURCE"]
 statics = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+#Views, the methods they accept and whether they are also served per ledger, registered by create_app
+ROUTES = []
+WARM = False
+APP = None
+#Every app built by create_app, their resources are closed by shutdown
+APPS = []
+#Shown when no database connection frees up in time
+BUSY = "Server busy, try again in a moment"
 
 
-def cleanup(loc:str):
-    assert os.path.isdir(loc), f"'{loc}' is not a directory"
-    for f in os.listdir(loc):
-        file_loc = os.path.join(statics, f)
-        if os.path.isfile(file_loc):
-            try:
-                os.remove(file_loc)
-            except Exception:
-                pass
-        else:
-            shutil.rmtree(file_loc, ignore_errors=True)
-    return
+def route(rule:str, methods:list[str], ledger:bool=True):
+    def register(view):
+        ROUTES.append((rule, view, methods, ledger))
+        return view
+    return register
 
 
-def startup():
-    if os.path.dirname(DATABASE):
-        assert os.access(os.path.dirname(DATABASE), os.W_OK), f"Cannot create database"
-    if not os.path.isfile(DATABASE):
-        db.init(DATABASE)
-        if os.path.isfile(DATA_SOURCE):
-            cn = sql.connect(DATABASE)
-            cur = cn.cursor()
-            types = db.get_types(cursor=cur)
-            with open(DATA_SOURCE) as fd:
-                entries = fd.readlines()
-                records = db.load(entries, types, delimiter='|')
-            db.insert(cur, records)
-            cn.commit()
+def settings()->dict:
+    return {
+        "PASSWORD":os.environ["DBPASSWORD"],
+        "PASSWORD2":os.environ["DBPASSWORD2"],
+        "DATABASE":os.environ["DATABASE"],
+        "DATA_SOURCE":os.environ["DATASOURCE"],
+        "CHART_CACHE_SIZE":int(os.environ.get("CHART_CACHE_SIZE", 256)),
+        "CHART_CACHE_TTL":int(os.environ.get("CHART_CACHE_TTL", 86400)),
+        "RENDER_WORKERS":int(os.environ.get("RENDER_WORKERS", 0)),
+        "CHART_BACKEND":os.environ.get("CHART_BACKEND", "png"),
+        "DB_POOL_SIZE":int(os.environ.get("DB_POOL_SIZE", 4)),
+        "DB_MMAP_SIZE":int(os.environ.get("DB_MMAP_SIZE", 268435456)),
+        "DB_CACHE_SIZE":int(os.environ.get("DB_CACHE_SIZE", 65536)),
+        "DB_STREAMS":int(os.environ.get("DB_STREAMS", 2)),
+        #Without SECRET_KEY sessions only last as long as the server (or worker, without preload)
+        "SECRET_KEY":os.environ.get("SECRET_KEY") or os.urandom(32).hex(),
+        "SESSION_TTL":int(os.environ.get("SESSION_TTL", 900)),
+        "AUTH_WORKERS":int(os.environ.get("AUTH_WORKERS", 2)),
+        "AUTH_BACKLOG":int(os.environ.get("AUTH_BACKLOG", 8)),
+        "REPORT_CACHE":os.environ.get("REPORT_CACHE", os.environ["DATABASE"]+".reports"),
+        "REPORT_CACHE_SIZE":int(os.environ.get("REPORT_CACHE_SIZE", 64)),
+        #Directory of ledger files served under /ledger/<name>/, unset serves only DATABASE
+        "LEDGERS":os.environ.get("LEDGERS", ""),
+        "LEDGER_CAPACITY":int(os.environ.get("LEDGER_CAPACITY", 64)),
+        "LEDGER_POOL_SIZE":int(os.environ.get("LEDGER_POOL_SIZE", 2)),
+        "JOBS":os.environ.get("JOBS", os.environ["DATABASE"]+".jobs"),
+        "JOB_WORKERS":int(os.environ.get("JOB_WORKERS", 1)),
+        #Records deleted per transaction, other writers get the database between them
+        "DELETE_CHUNK":int(os.environ.get("DELETE_CHUNK", 5000)),
+        "METRICS":os.environ.get("METRICS", "1") == "1",
+        #Requests with ?profile=1 (or an X-Profile header) save their cProfile stats here, unset disables profiling
+        "PROFILE_DIR":os.environ.get("PROFILE_DIR", ""),
+    }
+
+
+def startup(config:dict):
+    database = config["DATABASE"]
+    if os.path.dirname(database):
+        assert os.access(os.path.dirname(database), os.W_OK), f"Cannot create database"
+    if not os.path.isfile(database):
+        db.init(database)
+        if os.path.isfile(config["DATA_SOURCE"]):
+            cn = sql.connect(database)
+            with open(config["DATA_SOURCE"]) as fd:
+                report = ingest.ingest(cn, fd, delimiter='|')
             cn.close()
+            for number, error in report.errors:
+                print(f"{config['DATA_SOURCE']}:{number}: {error}")
+    cn = sql.connect(database)
+    db.migrate(cn.cursor())
+    cn.execute("PRAGMA journal_mode=WAL;")
+    cn.close()
     if not os.path.isdir(statics):
         os.mkdir(statics)
     return
 
 
-with app.app_context():
-    startup()
+def warmup(config:dict=None):
+    #Run once before forking web workers (gunicorn --preload or the on_starting hook):
+    #prepares the database and loads the chart backend so workers share it instead of importing it each
+    global WARM
+    if WARM:
+        return
+    config = config or settings()
+    startup(config)
+    charts.configure(config["RENDER_WORKERS"], config["CHART_BACKEND"])
+    charts.preload()
+    auth.configure(config["AUTH_WORKERS"], config["AUTH_BACKLOG"])
+    metrics.configure(config["METRICS"])
+    #Versions restart with a new database, reports cached before the server started may not belong to it
+    cache.Cache(config["REPORT_CACHE"], size=config["REPORT_CACHE_SIZE"]).clear()
+    jobs.Queue(config["JOBS"]).recover()
+    WARM = True
+    return
+
+
+def create_app(config:dict=None)->Flask:
+    started = time.perf_counter()
+    config = config or settings()
+    warmup(config)
+    app = Flask(__name__)
+    app.config.update(config)
+    app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(seconds=config["SESSION_TTL"])
+    app.config["SESSION_COOKIE_SAMESITE"] = "Strict"
+    for rule, view, methods, ledger in ROUTES:
+        app.add_url_rule(rule, view_func=view, methods=methods)
+        if ledger and config["LEDGERS"]:
+            app.add_url_rule("/ledger/<ledger>"+rule, view_func=view, methods=methods)
+    factory = metrics.Connection if config["METRICS"] else sql.Connection
+    if config["LEDGERS"]:
+        assert os.path.isdir(config["LEDGERS"]), f"Ledgers directory '{config['LEDGERS']}' does not exist"
+        app.extensions["ledgers"] = ledgers.Router(config["LEDGERS"], capacity=config["LEDGER_CAPACITY"],\
+                                    size=config["LEDGER_POOL_SIZE"], mmap_size=config["DB_MMAP_SIZE"], cache_size=config["DB_CACHE_SIZE"],\
+                                    factory=factory, streams=config["DB_STREAMS"])
+        atexit.register(app.extensions["ledgers"].close)
+        app.url_value_preprocessor(select_ledger)
+        app.url_defaults(link_ledger)
+    app.extensions["connections"] = connections.Pool(config["DATABASE"], size=config["DB_POOL_SIZE"],\
+                                    mmap_size=config["DB_MMAP_SIZE"], cache_size=config["DB_CACHE_SIZE"], factory=factory,\
+                                    streams=config["DB_STREAMS"])
+    atexit.register(app.extensions["connections"].close)
+    app.extensions["reports"] = cache.Cache(config["REPORT_CACHE"], size=config["REPORT_CACHE_SIZE"])
+    app.extensions["jobs"] = jobs.Queue(config["JOBS"], workers=config["JOB_WORKERS"])
+    app.before_request(begin_request)
+    app.after_request(end_request)
+    if config["PROFILE_DIR"]:
+        os.makedirs(config["PROFILE_DIR"], exist_ok=True)
+        app.before_request(start_profile)
+        app.teardown_request(save_profile)
+    atexit.register(app.extensions["jobs"].shutdown)
+    APPS.append(app)
+    app.config["STARTUP_SECONDS"] = time.perf_counter()-started
+    app.logger.info(f"Worker {os.getpid()} app ready in {app.config['STARTUP_SECONDS']*1000:.1f} ms")
+    return app
+
+
+def select_ledger(endpoint:str, values:dict):
+    if values and "ledger" in values:
+        g.ledger = values.pop("ledger")
+        try:
+            current_app.extensions["ledgers"].get(g.ledger)
+        except (ValueError, LookupError):
+            abort(404)
+    return
+
+
+def link_ledger(endpoint:str, values:dict):
+    #Links rendered for a ledger stay inside it
+    if "ledger" in g and current_app.url_map.is_endpoint_expecting(endpoint, "ledger"):
+        values.setdefault("ledger", g.ledger)
+    return
+
+
+def begin_request():
+    g.started = time.perf_counter()
+    #Imports queued before a restart resume without waiting for a new upload
+    current_app.extensions["jobs"].start()
+    return
+
 
+def end_request(response:Response)->Response:
+    if current_app.config["METRICS"] and "started" in g:
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUESTS.observe(time.perf_counter()-g.started, rule, request.method, response.status_code)
+    return response
 
-@app.route("/", methods=["GET", "POST"])
+
+def start_profile():
+    if request.args.get("profile") or request.headers.get("X-Profile"):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+    return
+
+
+def save_profile(error:Exception=None):
+    #Open with: python3 -m pstats <file>
+    if "profiler" in g:
+        g.profiler.disable()
+        name = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{request.endpoint}-{os.getpid()}.prof"
+        g.profiler.dump_stats(os.path.join(current_app.config["PROFILE_DIR"], name))
+    return
+
+
+def stream(template:str, release=None, buffer:int=16384, **context)->Response:
+    #Page sent while the template renders, in pieces of about buffer characters. release runs once the response is closed
+    rendered = stream_template(template, **context)
+    def generate():
+        pieces, size = [], 0
+        for piece in rendered:
+            pieces.append(piece)
+            size+=len(piece)
+            if size >= buffer:
+                yield "".join(pieces)
+                pieces, size = [], 0
+        yield "".join(pieces)
+    response = Response(generate(), mimetype="text/html")
+    if release:
+        response.call_on_close(release)
+    return response
+
+
+def pool()->connections.Pool:
+    if "ledger" in g:
+        return current_app.extensions["ledgers"].get(g.ledger).pool
+    return current_app.extensions["connections"]
+
+
+def shutdown():
+    #Called when a web worker exits
+    for app in APPS:
+        app.extensions["jobs"].shutdown()
+        app.extensions["connections"].close()
+        if "ledgers" in app.extensions:
+            app.extensions["ledgers"].close()
+    charts.shutdown()
+    auth.shutdown()
+    return
+
+
+def authenticate(levels:list[str]=["PASSWORD"])->str:
+    password = request.form.get("password", "")
+    if "ledger" in g:
+        try:
+            credentials = current_app.extensions["ledgers"].get(g.ledger).credentials()
+        except TimeoutError:
+            #Busy ledger, rejected like the password checks past AUTH_BACKLOG
+            return ""
+        return auth.authenticate(session, current_app.config, password, levels, hashes=credentials, scope=g.ledger)
+    return auth.authenticate(session, current_app.config, password, levels)
+
+
+def __getattr__(name:str):
+    #Keeps 'gunicorn main:app' working, the app is only built when first requested
+    global APP
+    if name == "app":
+        if APP is None:
+            APP = create_app()
+        return APP
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+@route("/", ["GET", "POST"])
 def home():
     customization = {"page_name":"[AutoFinance]", "home":True}
     if request.method != "POST": 
         return render_template("index2.html", **customization)
-    pwh = PasswordHasher()
-    try:
-        assert "password" in request.form, "" 
-        pwh.verify(passwd, request.form["password"])
-    except Exception:
+    if not authenticate():
         return render_template("index2.html", **customization)
+    charts.prune(statics, max_files=current_app.config["CHART_CACHE_SIZE"], ttl=current_app.config["CHART_CACHE_TTL"])
     try:
-        cn = sql.connect(DATABASE)
-    except Exception:
+        with pool().connection(readonly=True) as cn:
+            context = render.cached_report(current_app.extensions["reports"], cn.cursor(), "main", static_dir=statics, ledger=g.get("ledger", ""))
+    except (sql.Error, TimeoutError):
         return render_template("index2.html", **customization)
-    cleanup(statics)
-    cur = cn.cursor()
-    context = render.main_report(cur)
-    cn.close()
     return render_template("index.html", **context, **customization)
 
 
-@app.route("/insert", methods=["GET", "POST"])
+@route("/insert", ["GET", "POST"])
 def insert():
     customization = {"addcss":True, "page_name":"Insert Records", "insert":True}
     try:
-        cn = sql.connect(DATABASE)
-    except Exception:
+        with pool().connection(readonly=True) as cn:
+            cur = cn.cursor()
+            options = render.list_types(cur)
+            types = db.get_types(cursor=cur)
+    except sql.Error:
         return render_template("insert.html", **customization)
-    cur = cn.cursor()
-    options = render.list_types(cur)
-    types = db.get_types(cursor=cur)
-    cn.close()
+    except TimeoutError:
+        return render_template("insert.html", msg=render.err(BUSY), **customization)
     if request.method != "POST": 
         return render_template("insert.html", options=options, **customization)
-    pwh = PasswordHasher()
-    try:
-        assert "password" in request.form, "" 
-        pwh.verify(passwd, request.form["password"])
-    except Exception:
+    if not authenticate():
         return render_template("insert.html", msg=render.err("Incorrect Password"), options=options, **customization)
     if "file" in request.files and request.files["file"].filename.strip():
-        cn = sql.connect(DATABASE)
-        cur = cn.cursor()
         try:
-            file_cn = request.files["file"].read().decode()
-            entries = file_cn.split("\n")
-            records = db.load(entries, types, delimiter='|')
-            db.insert(cursor=cur, records=records)
-            cn.commit()
-            cn.close()
+            job = current_app.extensions["jobs"].submit(pool().location, request.files["file"].stream, ledger=g.get("ledger", ""))
             return render_template("insert.html", options=options,\
-                                msg=render.success(f"Inserted: {len(records)} records"), **customization)
+                                msg=render.queued(job, url_for("job", job=job)), **customization)
         except Exception as e:
             print(e)
             sys.stdout.flush()
-            cn.close()
             return render_template("insert.html", msg=render.err("Could not process file"),\
                                    options=options, **customization)
     try:
         record = read_inputs.read_insert(request.form, types=types)
     except Exception as e:
         return render_template("insert.html", msg=render.err(str(e)), options=options, **customization)
-    cn = sql.connect(DATABASE)
-    cur = cn.cursor()
-    db.insert(cursor=cur, records=record)
-    cn.commit()
-    cn.close()
+    try:
+        with pool().connection() as cn:
+            db.insert(cursor=cn.cursor(), records=record)
+            cn.commit()
+    except TimeoutError:
+        return render_template("insert.html", msg=render.err(BUSY), options=options, **customization)
     return render_template("insert.html", options=options, msg=render.success("Inserted record"), **customization)
 
 
-@app.route("/delete", methods=["GET", "POST"])
+@route("/delete", ["GET", "POST"])
 def delete():
     customization = {"addcss":True, "page_name":"Delete Records", "delete":True}
     try:
-        cn = sql.connect(DATABASE)
-    except Exception:
+        with pool().connection(readonly=True) as cn:
+            options = render.list_types(cn.cursor())
+    except sql.Error:
         return render_template("delete.html", **customization)
-    cur = cn.cursor()
-    options = render.list_types(cur)
-    cn.close()
+    except TimeoutError:
+        return render_template("delete.html", msg=render.err(BUSY), **customization)
     if request.method != "POST": 
         return render_template("delete.html", options=options, **customization)
-    pwh = PasswordHasher()
-    try:
-        assert "password" in request.form, "" 
-        pwh.verify(passwd, request.form["password"])
-    except Exception:
+    if not authenticate():
         return render_template("delete.html", msg=render.err("Incorrect Password"), options=options, **customization)
     try:
         params = read_inputs.read_delete(request.form)
     except Exception as e:
         return render_template("delete.html", msg=render.err(str(e)), options=options, **customization)
-    cn = sql.connect(DATABASE)
-    cur = cn.cursor()
-    db.delete(cursor=cur, **params)
-    cn.commit()
-    cn.close()
-    return render_template("delete.html", msg=render.success(f"Deleted record(s)"), options=options, **customization)
+    #The first post shows what matches, deleting takes the confirmation (the password is kept by the session)
+    try:
+        if not request.form.get("confirm"):
+            with pool().connection(readonly=True) as cn:
+                count, preview = db.delete_preview(cn.cursor(), **params)
+            fields = {k:v for k, v in request.form.items() if k != "password"}
+            return render_template("delete.html", count=count, preview=preview, fields=fields, options=options, **customization)
+        with pool().connection() as cn:
+            deleted = db.delete_chunked(cn.cursor(), chunk=current_app.config["DELETE_CHUNK"], **params)
+    except ValueError as e:
+        return render_template("delete.html", msg=render.err(str(e)), options=options, **customization)
+    except TimeoutError:
+        return render_template("delete.html", msg=render.err(BUSY), options=options, **customization)
+    return render_template("delete.html", msg=render.success(f"Deleted {deleted} record(s)"), options=options, **customization)
 
 
-@app.route("/custom", methods=["GET", "POST"])
+@route("/custom", ["GET", "POST"])
 def custom():
     customization = {"addcss":True, "page_name":"Custom Reports", "custom":True}
     try:
-        cn = sql.connect(DATABASE)
-    except Exception:
+        with pool().connection(readonly=True) as cn:
+            options = render.list_types(cn.cursor())
+    except sql.Error:
         return render_template("custom2.html", **customization)
-    cur = cn.cursor()
-    options = render.list_types(cur)
-    cn.close()
+    except TimeoutError:
+        return render_template("custom2.html", msg=render.err(BUSY), **customization)
     if request.method != "POST": 
         return render_template("custom2.html", options=options, **customization)
-    pwh = PasswordHasher()
-    try:
-        assert "password" in request.form, "" 
-        pwh.verify(passwd, request.form["password"])
-    except Exception:
+    if not authenticate():
         return render_template("custom2.html", msg=render.err("Incorrect Password"), options=options, **customization)
     try:
         params = read_inputs.read_custom(request.form)
     except Exception as e:
         return render_template("custom2.html", msg=render.err(str(e)), options=options, **customization)
-    cleanup(statics)
-    cn = sql.connect(DATABASE)
-    cur = cn.cursor()
-    context = render.custom_report(cursor=cur, **params)
-    cn.close()
+    charts.prune(statics, max_files=current_app.config["CHART_CACHE_SIZE"], ttl=current_app.config["CHART_CACHE_TTL"])
+    try:
+        with pool().connection(readonly=True) as cn:
+            context = render.cached_report(current_app.extensions["reports"], cn.cursor(), "custom", static_dir=statics, ledger=g.get("ledger", ""), **params)
+    except TimeoutError:
+        return render_template("custom2.html", msg=render.err(BUSY), options=options, **customization)
     return render_template("custom.html", options=options,  **customization, **context)
 
 
-@app.route("/all", methods=["GET", "POST"])
+@route("/all", ["GET", "POST"])
 def see():
+    #GET with query parameters pages through the records of a session already authenticated, as HTML or format=json
     customization = {"page_name":"See Records", "see":True}
-    if request.method != "POST": 
+    paging = request.method == "GET" and bool(request.args)
+    if request.method != "POST" and not paging:
         return render_template("see.html", **customization)
-    pwh = PasswordHasher()
-    backup = False
-    try:
-        assert "password" in request.form, "" 
+    level = authenticate(["PASSWORD", "PASSWORD2"])
+    if not level:
+        if paging and request.args.get("format") == "json":
+            abort(403)
+        return render_template("see.html", table=render.err("Incorrect Password"), **customization)
+    if level == "PASSWORD2" and not paging:
+        source = pool()
         try:
-            pwh.verify(passwd, request.form["password"])
+            cn = source.acquire(stream=True)
+        except TimeoutError:
+            return render_template("see.html", table=render.err(BUSY), **customization)
         except Exception:
-            pwh.verify(passwd2, request.form["password"])
-            backup = True
-    except Exception:
-        return render_template("see.html", table=render.err("Incorrect Password"), **customization)
+            return render_template("see.html", **customization)
+        compress = "gzip" in request.accept_encodings
+        headers = {"Content-Disposition":f"attachment; filename=backup_{datetime.today().strftime('%F')}.csv", "Vary":"Accept-Encoding"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        #The connection stays checked out while the response streams, it's released once the response is closed
+        #(also when the client leaves before the first chunk)
+        response = Response(render.backup(cn.cursor(), compress=compress), mimetype="text/csv", headers=headers)
+        response.call_on_close(lambda: source.release(cn, stream=True))
+        return response
+    def failed(message:str, status:int=400):
+        if request.args.get("format") == "json":
+            return jsonify({"error":message}), status
+        return render_template("see.html", table=render.err(message), **customization)
+    #HTML pages are streamed, JSON is built at once
+    streamed = request.args.get("format") != "json"
+    source = pool()
     try:
-        cn = sql.connect(DATABASE)
+        params = read_inputs.read_page(request.args)
+        cn = source.acquire(readonly=True, stream=streamed)
+    except TimeoutError:
+        return failed(BUSY, 503)
+    except ValueError as e:
+        return failed(str(e))
     except Exception:
         return render_template("see.html", **customization)
-    cur = cn.cursor()
-    if backup:
-        file = render.backup(cur)
-        cn.close()
-        return send_file(file, as_attachment=True, download_name=f"backup_{datetime.today().strftime('%F')}.csv")
-    context = render.table(cur)
-    cn.close()
-    return render_template("see.html", table=context, **customization)
+    try:
+        rows = db.page(cn.cursor(), **params)
+    except (ValueError, sql.Error) as e:
+        source.release(cn, readonly=True, stream=streamed)
+        return failed(str(e))
+    link = lambda after: url_for("see", **{**request.args, "after":after})
+    page = render.Page(rows, params["size"], link)
+    if not streamed:
+        try:
+            records = [dict(zip(["type", "description", "amount", "date"], r)) for r in page]
+        finally:
+            source.release(cn, readonly=True)
+        return jsonify({"records":records, "after":page.key or None, "next":page.older or None})
+    return stream("see.html", lambda: source.release(cn, stream=True), page=page, **customization)
+
+
+@route("/jobs/<job>", ["GET"])
+def job(job):
+    #Job ids are random and only given to the client that uploaded the file
+    status = current_app.extensions["jobs"].status(job)
+    if status is None or status["ledger"] != g.get("ledger", ""):
+        abort(404)
+    return jsonify(status)
+
+
+@route("/metrics", ["GET"], ledger=False)
+def exposition():
+    #Only served to the machine itself, each web worker reports its own numbers
+    if not current_app.config["METRICS"] or request.remote_addr not in {"127.0.0.1", "::1"}:
+        abort(404)
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
 
 
-@app.route("/<invalid>", methods=["GET"])
+@route("/<invalid>", ["GET"], ledger=False)
 def invalid(invalid):
     return redirect(url_for('home'))
 
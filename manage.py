@@ -0,0 +1,147 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Maintenance commands for existing databases
+
+import sys
+import ingest
+import ledgers
+import argparse
+import snapshot
+import database as db
+import sqlite3 as sql
+
+
+def rollup(args:argparse.Namespace):
+    cn = sql.connect(args.database)
+    cur = cn.cursor()
+    if args.rebuild:
+        db.rebuild_rollup(cur)
+        cn.commit()
+        print("Rebuilt monthly rollup")
+    try:
+        mismatches = db.verify_rollup(cur)
+    except AssertionError as e:
+        print(e)
+        return 1
+    finally:
+        cn.close()
+    for m in mismatches:
+        print(f"Out of sync month: {m[0]} type: {m[1]} sign: {m[2]} rollup: {m[3]} ({m[4]}) records: {m[5]} ({m[6]})")
+    if mismatches:
+        return 1
+    print("Monthly rollup is in sync")
+    return 0
+
+
+def migrate(args:argparse.Namespace):
+    cn = sql.connect(args.database)
+    cur = cn.cursor()
+    try:
+        applied = db.migrate(cur)
+    finally:
+        cn.close()
+    for migration in applied:
+        print(f"Applied: {migration}")
+    print(f"Schema version: {len(db.MIGRATIONS)}")
+    return 0
+
+
+def search(args:argparse.Namespace):
+    cn = sql.connect(args.database)
+    cur = cn.cursor()
+    try:
+        created = db.create_search(cur)
+        cn.commit()
+    finally:
+        cn.close()
+    if not created:
+        print("SQLite was built without FTS5, descriptions will be filtered with LIKE")
+        return 1
+    print("Rebuilt description search index")
+    return 0
+
+
+def load(args:argparse.Namespace):
+    cn = sql.connect(args.database)
+    try:
+        with open(args.file, encoding="utf-8", errors="replace") as fd:
+            report = ingest.ingest(cn, fd, delimiter=args.delimiter, chunk=args.chunk)
+    finally:
+        cn.close()
+    for number, error in report.errors:
+        print(f"{args.file}:{number}: {error}", file=sys.stderr)
+    if report.rejected > len(report.errors):
+        print(f"... {report.rejected-len(report.errors)} more rejected lines", file=sys.stderr)
+    print(f"Read: {report.lines} lines, inserted: {report.inserted}, rejected: {report.rejected}")
+    return 1 if report.rejected else 0
+
+
+def dump(args:argparse.Namespace):
+    cn = sql.connect(args.database)
+    try:
+        rows = snapshot.export(cn.cursor(), args.file)
+    finally:
+        cn.close()
+    print(f"Exported {rows} records to {args.file}")
+    return 0
+
+
+def restore(args:argparse.Namespace):
+    cn = sql.connect(args.database)
+    try:
+        rows = snapshot.restore(cn, args.file, replace=not args.append)
+    finally:
+        cn.close()
+    print(f"Restored {rows} records from {args.file}")
+    return 0
+
+
+def ledger(args:argparse.Namespace):
+    router = ledgers.Router(args.directory)
+    existed = router.exists(args.name)
+    credentials = {"PASSWORD":args.password, "PASSWORD2":args.download}
+    router.create(args.name, {level:hash_ for level, hash_ in credentials.items() if hash_})
+    print(f"{'Updated' if existed else 'Created'} ledger '{args.name}' at {router.location(args.name)}")
+    return 0
+
+
+def parser()->argparse.ArgumentParser:
+    prs = argparse.ArgumentParser(description="AutoFinance maintenance commands")
+    commands = prs.add_subparsers(dest="command", required=True)
+    roll = commands.add_parser("rollup", help="Verify or rebuild the monthly rollup table")
+    roll.add_argument("database", help="Path to database")
+    roll.add_argument("--rebuild", action="store_true", help="Recreate the rollup from records before verifying")
+    roll.set_defaults(run=rollup)
+    mig = commands.add_parser("migrate", help="Apply pending schema migrations")
+    mig.add_argument("database", help="Path to database")
+    mig.set_defaults(run=migrate)
+    srch = commands.add_parser("search", help="Create or rebuild the description search index")
+    srch.add_argument("database", help="Path to database")
+    srch.set_defaults(run=search)
+    imp = commands.add_parser("import", help="Bulk load a Type|Description|Amount|Date file")
+    imp.add_argument("database", help="Path to database")
+    imp.add_argument("file", help="File to import, one record per line")
+    imp.add_argument("--delimiter", default="|", help="Field delimiter (default: |)")
+    imp.add_argument("--chunk", type=int, default=5000, help="Records inserted per transaction (default: 5000)")
+    imp.set_defaults(run=load)
+    snap = commands.add_parser("snapshot", help="Export records to a binary snapshot")
+    snap.add_argument("database", help="Path to database")
+    snap.add_argument("file", help="Snapshot to write")
+    snap.set_defaults(run=dump)
+    rest = commands.add_parser("restore", help="Load records from a binary snapshot")
+    rest.add_argument("database", help="Path to database")
+    rest.add_argument("file", help="Snapshot to read")
+    rest.add_argument("--append", action="store_true", help="Keep the current records instead of replacing them")
+    rest.set_defaults(run=restore)
+    led = commands.add_parser("ledger", help="Create a ledger served under /ledger/<name>/ or change its passwords")
+    led.add_argument("directory", help="Directory of ledgers (LEDGERS)")
+    led.add_argument("name", help="Ledger name: letters, digits, - and _")
+    led.add_argument("--password", help="Argon password hash to view/insert/delete data")
+    led.add_argument("--download", help="Argon password hash to download data")
+    led.set_defaults(run=ledger)
+    return prs
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    sys.exit(args.run(args))
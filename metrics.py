@@ -0,0 +1,218 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Request, report phase and SQLite statement timings of a web worker in Prometheus text format.
+#Every worker process keeps its own numbers
+
+import re
+import time
+import threading
+import sqlite3 as sql
+from functools import lru_cache
+from contextlib import contextmanager
+
+
+ENABLED = True
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+#SQLite virtual machine instructions between calls of the progress handler
+STEPS = 100000
+#Rows fetched at a time when a cursor is iterated
+BATCH = 1024
+
+
+def escape(value:str)->str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+
+    def __init__(self, name:str, help_:str, labels:list[str]):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount:float=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0)+amount
+        return
+
+    def tags(self, labels:tuple, extra:str="")->str:
+        tags = [f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels)]+([extra] if extra else [])
+        return "{"+",".join(tags)+"}" if tags else ""
+
+    def lines(self)->list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{self.tags(labels)} {value}")
+        return lines
+
+
+class Histogram(Counter):
+
+    def __init__(self, name:str, help_:str, labels:list[str], buckets:list[float]=BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = buckets
+
+    def observe(self, value:float, *labels):
+        with self.lock:
+            if labels not in self.values:
+                #Count per bucket (not cumulative), sum, count
+                self.values[labels] = [[0]*len(self.buckets), 0.0, 0]
+            counts, _, _ = entry = self.values[labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i]+=1
+                    break
+            entry[1]+=value
+            entry[2]+=1
+        return
+
+    def lines(self)->list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative+=n
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{self.tags(labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{self.tags(labels, le)} {count}")
+                lines.append(f"{self.name}_sum{self.tags(labels)} {total}")
+                lines.append(f"{self.name}_count{self.tags(labels)} {count}")
+        return lines
+
+
+REGISTRY = []
+REQUESTS = Histogram("autofinance_request_seconds", "Time to build the response by route", ["route", "method", "status"])
+PHASES = Histogram("autofinance_phase_seconds", "Time spent in each report and chart phase", ["phase"])
+QUERIES = Histogram("autofinance_query_seconds", "Time executing and fetching SQLite statements by shape", ["shape"])
+STATEMENTS = Counter("autofinance_statements_total", "SQLite statements run by shape, trigger programs included", ["shape"])
+INSTRUCTIONS = Counter("autofinance_query_instructions_total", "SQLite virtual machine instructions by statement shape", ["shape"])
+
+
+def configure(enabled:bool=True):
+    global ENABLED
+    ENABLED = enabled
+    return
+
+
+def exposition()->str:
+    lines = []
+    for metric in REGISTRY:
+        lines+=metric.lines()
+    return "\n".join(lines)+"\n"
+
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def shape(statement:str)->str:
+    #Statement with literals replaced by ? and whitespace collapsed, the trace callback sees bound values
+    statement = SPACES.sub(" ", LITERALS.sub("?", statement)).strip()
+    return statement[:200]
+
+
+@contextmanager
+def phase(name:str):
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASES.observe(time.perf_counter()-started, name)
+
+
+class Cursor(sql.Cursor):
+    #A statement is observed once, with the time of execute and of fetching its rows, when its rows run out
+    #or the cursor runs another statement
+
+    def start(self, statement:str):
+        self.finish()
+        self.shape = shape(statement)
+        self.elapsed = 0.0
+        return
+
+    def finish(self):
+        if getattr(self, "shape", None):
+            QUERIES.observe(self.elapsed, self.shape)
+            self.shape = None
+        return
+
+    def timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.elapsed+=time.perf_counter()-started
+
+    def execute(self, statement:str, parameters=()):
+        self.start(statement)
+        self.timed(super().execute, statement, parameters)
+        if self.description is None:
+            self.finish()
+        return self
+
+    def executemany(self, statement:str, parameters):
+        self.start(statement)
+        self.timed(super().executemany, statement, parameters)
+        self.finish()
+        return self
+
+    def __iter__(self):
+        #Rows are fetched in batches, timing each row would slow down the reports that read many
+        rows = self.fetchmany(BATCH)
+        while rows:
+            yield from rows
+            rows = self.fetchmany(BATCH)
+
+    def fetchone(self):
+        row = self.timed(super().fetchone)
+        if row is None:
+            self.finish()
+        return row
+
+    def fetchmany(self, size:int=None):
+        rows = self.timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        rows = self.timed(super().fetchall)
+        self.finish()
+        return rows
+
+    def close(self):
+        self.finish()
+        super().close()
+        return
+
+
+class Connection(sql.Connection):
+    #Counts every statement through the trace callback and the work of each through the progress handler
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.current = ""
+        self.set_trace_callback(self.traced)
+        self.set_progress_handler(self.progress, STEPS)
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def traced(self, statement:str):
+        self.current = shape(statement)
+        STATEMENTS.inc(self.current)
+        return
+
+    def progress(self):
+        INSTRUCTIONS.inc(self.current, amount=STEPS)
+        return 0
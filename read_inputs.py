@@ -53,8 +53,11 @@ def read_delete(params:dict[str, str]):
 
 def read_custom(params:dict[str, str]):
     required = {}
-    default = {"type_":"All", "description":"", "start":None, "end":None}
+    default = {"type_":"All", "description":"", "start":None, "end":None, "period":"month"}
     parsed = read_input(params, required, default)
+    from resample import PERIODS
+    if parsed["period"] not in PERIODS:
+        raise ValueError(f"Period must be: {', '.join(PERIODS)}")
     if parsed["type_"] == "All":
         parsed["type_"] = "" 
     if parsed["end"]:
@@ -68,3 +71,30 @@ def read_custom(params:dict[str, str]):
     else:
         parsed["start"] = None
     return parsed
+
+
+def read_page(params:dict[str, str], max_size:int=10000):
+    #Page of /all, after is the key "date_id" handed out with the previous page
+    required = {}
+    default = {"type_":"All", "description":"", "start":"", "end":"", "size":"30", "after":""}
+    parsed = read_input(params, required, default)
+    if parsed["type_"] == "All":
+        parsed["type_"] = ""
+    for date in ("start", "end"):
+        parsed[date] = read_date(parsed[date]) if parsed[date] else None
+    if parsed["start"] and parsed["end"] and parsed["start"] > parsed["end"]:
+        raise ValueError("Start must be before or equal to end date")
+    try:
+        parsed["size"] = int(parsed["size"])
+    except ValueError:
+        raise ValueError(f"Could not read page size: '{parsed['size']}'")
+    if not 0 < parsed["size"] <= max_size:
+        raise ValueError(f"Page size must be between 1 and {max_size}")
+    if parsed["after"]:
+        date, _, id_ = parsed["after"].rpartition("_")
+        if not id_.isdigit():
+            raise ValueError(f"Could not read page key: '{parsed['after']}'")
+        parsed["after"] = (read_date(date).strftime("%F"), int(id_))
+    else:
+        parsed["after"] = None
+    return parsed
@@ -1,13 +1,16 @@
 #!./venv/bin/python3
 #Fernando Lavarreda
 
-import os
-import uuid
-import graph
+import zlib
+import cache
+import charts
+import report
+import metrics
 import sqlite3 as sql
 import database as db
-from io import BytesIO
+from html import escape
 from datetime import datetime
+from typing import Iterator
 
 
 def err(msg:str):
@@ -18,6 +21,10 @@ def success(msg:str):
     return f'<p class="h6 text-success">{msg}</p>'
 
 
+def queued(job:str, status:str)->str:
+    return success(f'Import queued, progress: <a href="{escape(status)}">{escape(job)}</a>')
+
+
 def list_types(cursor:sql.Cursor):
     types = db.get_types(cursor)
     html = ""
@@ -38,101 +45,100 @@ def nullify(input_):
 
 def main_report(cursor:sql.Cursor, static_dir:str="./static"):
     context = {}
-    context["records"] = db.get_count(cursor)
-    context["inflow"] = nullify(db.sum_sign(cursor, select="positive"))
-    context["outflow"] = nullify(db.sum_sign(cursor, select="negative"))
-    context["netflow"] = nullify(db.sum_sign(cursor))
-    context["historic"] = os.path.join(static_dir, str(uuid.uuid4())+".png")
-    context["monthly_flow"] = os.path.join(static_dir, str(uuid.uuid4())+".png")
-    context["cumulative"] = os.path.join(static_dir, str(uuid.uuid4())+".png")
-    historic = db.cumulative(cursor)
-    flows = db.monthly_flow(cursor, force_end_date=datetime.today())
-    cumulative_pos = db.cumulative(cursor, select="positive")
-    cumulative_neg = db.cumulative(cursor, select="negative")
-    context["historic"] = os.path.basename(graph.series(historic, color="blue", save=context["historic"]))
-    context["monthly_flow"] = os.path.basename(graph.series(flows, color="golden", save=context["monthly_flow"]))
-    context["cumulative"] = os.path.basename(graph.mseries([cumulative_pos, cumulative_neg],colors=["green", "red"],\
-                            labels=["Inflow", "Outflow"], save=context["cumulative"], absolute=True))
-
-    context["medianinf"] = nullify(db.monthly_flow_median(cursor, force_end_date=datetime.today(), select="positive"))
-    context["meaninf"] = nullify(db.monthly_flow_mean(cursor, force_end_date=datetime.today(), select="positive"))
-    context["stdinf"] = nullify(db.monthly_flow_sd(cursor, force_end_date=datetime.today(), select="positive"))
-    context["maxinf"] = nullify(db.monthly_flow_max(cursor, force_end_date=datetime.today(), select="positive"))
-
-    context["medianou"] = nullify(db.monthly_flow_median(cursor, force_end_date=datetime.today(), select="negative"))
-    context["meanou"] = nullify(db.monthly_flow_mean(cursor, force_end_date=datetime.today(), select="negative"))
-    context["stdou"] = nullify(db.monthly_flow_sd(cursor, force_end_date=datetime.today(), select="negative"))
-    context["maxou"] = nullify(db.monthly_flow_min(cursor, force_end_date=datetime.today(), select="negative"))
-
-    context["mediannet"] = nullify(db.monthly_flow_median(cursor, force_end_date=datetime.today()))
-    context["meannet"] = nullify(db.monthly_flow_mean(cursor, force_end_date=datetime.today()))
-    context["stdnet"] = nullify(db.monthly_flow_sd(cursor, force_end_date=datetime.today()))
-    context["maxnet"] = nullify(db.monthly_flow_max(cursor, force_end_date=datetime.today()))
-    context["minnet"] = nullify(db.monthly_flow_min(cursor, force_end_date=datetime.today()))
-
-    context["medianin"] = nullify(db.get_median(cursor, type_="Income"))
-    context["meanin"] = nullify(db.get_avg(cursor, type_="Income"))
-    context["stdin"] = nullify(db.get_std(cursor, type_="Income"))
-    context["maxin"] = nullify(db.get_max(cursor, type_="Income"))
-
-    context["medianne"] = nullify(db.get_median(cursor, type_="Necessity"))
-    context["meanne"] = nullify(db.get_avg(cursor, type_="Necessity"))
-    context["stdne"] = nullify(db.get_std(cursor, type_="Necessity"))
-    context["maxne"] = nullify(db.get_min(cursor, type_="Necessity"))
-
-    context["medianpe"] = nullify(db.get_median(cursor, type_="Pleasure"))
-    context["meanpe"] = nullify(db.get_avg(cursor, type_="Pleasure"))
-    context["stdpe"] = nullify(db.get_std(cursor, type_="Pleasure"))
-    context["maxpe"] = nullify(db.get_min(cursor, type_="Pleasure"))
-
-    context["medianinv"] = nullify(db.get_median(cursor, type_="Investment"))
-    context["stdinv"] = nullify(db.get_std(cursor, type_="Investment"))
-    context["maxinv"] = nullify(db.get_max(cursor, type_="Investment"))
-    context["mininv"] = nullify(db.get_min(cursor, type_="Investment"))
-
-    context["medianem"] = nullify(db.get_median(cursor, type_="Emergency"))
-    context["meanem"] = nullify(db.get_avg(cursor, type_="Emergency"))
-    context["stdem"] = nullify(db.get_std(cursor, type_="Emergency"))
-    context["maxem"] = nullify(db.get_min(cursor, type_="Emergency"))
+    today = datetime.today()
+    with metrics.phase("main_report.scan"):
+        ledger = report.scan(cursor)
+    context["records"] = ledger.count
+    context["inflow"] = nullify(report.total(ledger, select="positive"))
+    context["outflow"] = nullify(report.total(ledger, select="negative"))
+    context["netflow"] = nullify(report.total(ledger))
+    with metrics.phase("main_report.balances"):
+        balances = db.balances(cursor)
+    historic = balances["all"]
+    flows = report.monthly(ledger, force_end_date=today)
+    cumulative_pos = balances["positive"]
+    cumulative_neg = balances["negative"]
+    pictures = charts.render(static_dir, [
+        charts.job("series", historic, color="blue"),
+        charts.job("series", flows, color="golden"),
+        charts.job("mseries", [cumulative_pos, cumulative_neg], colors=["green", "red"], labels=["Inflow", "Outflow"], absolute=True),
+    ])
+    context["historic"], context["monthly_flow"], context["cumulative"] = pictures
+
+    inflow = report.monthly_stats(report.monthly(ledger, select="positive", force_end_date=today))
+    context["medianinf"] = nullify(inflow["median"])
+    context["meaninf"] = nullify(inflow["mean"])
+    context["stdinf"] = nullify(inflow["sd"])
+    context["maxinf"] = nullify(inflow["max"])
+
+    outflow = report.monthly_stats(report.monthly(ledger, select="negative", force_end_date=today))
+    context["medianou"] = nullify(outflow["median"])
+    context["meanou"] = nullify(outflow["mean"])
+    context["stdou"] = nullify(outflow["sd"])
+    context["maxou"] = nullify(outflow["min"])
+
+    netflow = report.monthly_stats(flows)
+    context["mediannet"] = nullify(netflow["median"])
+    context["meannet"] = nullify(netflow["mean"])
+    context["stdnet"] = nullify(netflow["sd"])
+    context["maxnet"] = nullify(netflow["max"])
+    context["minnet"] = nullify(netflow["min"])
+
+    income = report.type_stats(ledger, "Income")
+    context["medianin"] = nullify(income["median"])
+    context["meanin"] = nullify(income["mean"])
+    context["stdin"] = nullify(income["std"])
+    context["maxin"] = nullify(income["max"])
+
+    necessity = report.type_stats(ledger, "Necessity")
+    context["medianne"] = nullify(necessity["median"])
+    context["meanne"] = nullify(necessity["mean"])
+    context["stdne"] = nullify(necessity["std"])
+    context["maxne"] = nullify(necessity["min"])
+
+    pleasure = report.type_stats(ledger, "Pleasure")
+    context["medianpe"] = nullify(pleasure["median"])
+    context["meanpe"] = nullify(pleasure["mean"])
+    context["stdpe"] = nullify(pleasure["std"])
+    context["maxpe"] = nullify(pleasure["min"])
+
+    investment = report.type_stats(ledger, "Investment")
+    context["medianinv"] = nullify(investment["median"])
+    context["stdinv"] = nullify(investment["std"])
+    context["maxinv"] = nullify(investment["max"])
+    context["mininv"] = nullify(investment["min"])
+
+    emergency = report.type_stats(ledger, "Emergency")
+    context["medianem"] = nullify(emergency["median"])
+    context["meanem"] = nullify(emergency["mean"])
+    context["stdem"] = nullify(emergency["std"])
+    context["maxem"] = nullify(emergency["min"])
     return context
 
 
-def custom_report(cursor:sql.Cursor, static_dir:str="./static", force_end_date:datetime=None, **kwargs):
+def custom_report(cursor:sql.Cursor, static_dir:str="./static", force_end_date:datetime=None, period:str="month", **kwargs):
     context = {}
-    context["records"] = db.get_count(cursor, **kwargs)
-    context["sum"] = nullify(db.sum_sign(cursor, **kwargs))
-    context["median"] = nullify(db.get_median(cursor, **kwargs))
-    context["mean"] = nullify(db.get_avg(cursor, **kwargs))
-    context["std"] = nullify(db.get_std(cursor, **kwargs))
-    context["monthly_flow"] = os.path.join(static_dir, str(uuid.uuid4())+".png")
-    context["daily_flow"] = os.path.join(static_dir, str(uuid.uuid4())+".png")
-    context["cumulative"] = os.path.join(static_dir, str(uuid.uuid4())+".png")
-    mflows = db.monthly_flow(cursor, force_end_date=force_end_date, **kwargs)
-    dflows = db.daily_flow(cursor, **kwargs)
-    cumulative = db.cumulative(cursor, **kwargs)
-    context["monthly_flow"] = os.path.basename(graph.series(mflows, color="golden", save=context["monthly_flow"]))
-    context["daily_flow"] = os.path.basename(graph.series(dflows, color="#6432a8", scatter=True, save=context["daily_flow"]))
-    context["cumulative"] = os.path.basename(graph.series(cumulative, color="blue", save=context["cumulative"]))
-    min_ = db.get_min(cursor, limit=5, **kwargs)
-    max_ = db.get_max(cursor, limit=5, **kwargs)
-    title = """<table class="table table-dark table-striped">
-            <thead><tr><th>Amount</th><th>Description</th><th>Type</th><th>Date</th></tr></thead><tbody>"""
-    if min_:
-        tbmin = title
-        for mn in min_:
-            tbmin += f'<tr><td>{mn[0]}</td><td>{mn[2]}</td><td>{mn[1]}</td><td>{mn[3]}</td></tr>'
-        min_ = tbmin+'</tbody></table>'
-    else:
-        min_ = f'<div class="row"><div class="col"></div><div class="col">-</div></div>'
-    if max_:
-        tbmax = title
-        for mx in max_:
-            tbmax += f'<tr><td>{mx[0]}</td><td>{mx[2]}</td><td>{mx[1]}</td><td>{mx[3]}</td></tr>'
-        max_ = tbmax+'</tbody></table>'
-    else:
-        max_ = f'<div class="row"><div class="col"></div><div class="col">-</div></div>'
-    context["min"] = min_
-    context["max"] = max_
+    with metrics.phase("custom_report.stats"):
+        stats = db.get_stats(cursor, **kwargs)
+    context["records"] = stats["count"]
+    context["sum"] = nullify(stats["sum"])
+    context["median"] = nullify(stats["median"])
+    context["mean"] = nullify(stats["mean"])
+    context["std"] = nullify(stats["std"])
+    with metrics.phase("custom_report.flows"):
+        flows = db.flow(cursor, period, force_end_date=force_end_date, **kwargs)
+        dflows = db.daily_flow(cursor, **kwargs)
+        cumulative = db.cumulative(cursor, period, **kwargs)
+    pictures = charts.render(static_dir, [
+        charts.job("series", flows, color="golden"),
+        charts.job("series", dflows, color="#6432a8", scatter=True),
+        charts.job("series", cumulative, color="blue"),
+    ])
+    context["monthly_flow"], context["daily_flow"], context["cumulative"] = pictures
+    context["period"] = {"day":"Daily", "week":"Weekly", "month":"Monthly", "quarter":"Quarterly", "year":"Yearly"}[period]
+    #Rows as lists, the template draws the tables
+    context["min"] = [list(r) for r in db.get_min(cursor, limit=5, **kwargs)]
+    context["max"] = [list(r) for r in db.get_max(cursor, limit=5, **kwargs)]
 
     context["medianmo"] = nullify(db.monthly_flow_median(cursor, force_end_date=force_end_date, **kwargs))
     context["meanmo"] = nullify(db.monthly_flow_mean(cursor, force_end_date=force_end_date, **kwargs))
@@ -142,25 +148,62 @@ def custom_report(cursor:sql.Cursor, static_dir:str="./static", force_end_date:d
     return context
 
 
-def backup(cursor:sql.Cursor)->BytesIO:
-    data = db.peek(cursor, limit=-1)
-    header = "|".join(["type", "description", "amount", "date"])
-    body = "\n"
-    for record in data:
-        body+="|".join([str(rd) for rd in record])+"\n"
-    return BytesIO((header+body).encode())
-
-
-def table(cursor:sql.Cursor)->str:
-    data = db.peek(cursor)
-    if data:
-        html = """<table class="table table-dark table-striped">
-                <thead><tr><th>Type</th><th>Description</th><th>Amount</th><th>Date</th></tr></thead>"""
-    else:
-        html = 	'<div class="col"><p class="h4">No Data Available</p></div>'
-    for d in data:
-        row = f'<tr><td>{d[0]}</td><td>{d[1]}</td><td>{d[2]}</td><td>{d[3]}</td></tr>' 
-        html+=row
-    if data:
-        html+="</table>"
-    return html
+#Context keys holding chart file names, per report
+PICTURES = {"main":["historic", "monthly_flow", "cumulative"], "custom":["monthly_flow", "daily_flow", "cumulative"]}
+
+
+def cached_report(reports:cache.Cache, cursor:sql.Cursor, kind:str, static_dir:str="./static", ledger:str="", **kwargs):
+    #The version is read before the report so a write in between can only make the stored entry stale.
+    #Today is part of the key since reports fill months up to it
+    builders = {"main":main_report, "custom":custom_report}
+    version = db.data_version(cursor)
+    key = reports.key(kind, {**kwargs, "today":datetime.today().strftime("%F")}, version, ledger)
+    with metrics.phase("report_cache.get"):
+        context = reports.get(key)
+    if context and all([charts.hit(static_dir, context[p]) for p in PICTURES[kind] if context[p]]):
+        return context
+    with metrics.phase(f"{kind}_report"):
+        context = builders[kind](cursor, static_dir=static_dir, **kwargs)
+    reports.put(key, version, context, ledger)
+    return context
+
+
+def backup(cursor:sql.Cursor, compress:bool=False)->Iterator[bytes]:
+    #Backup file in chunks, gzip compressed on the fly when compress is set
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    def encode(text:str)->bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+    yield encode("|".join(["type", "description", "amount", "date"])+"\n")
+    for records in db.export(cursor):
+        chunk = encode("".join(["|".join([str(rd) for rd in record])+"\n" for record in records]))
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+    return
+
+
+class Page:
+    #Records of one page of db.page pulled from the cursor while the template renders them.
+    #Once they run out, key holds the "date_id" key of the next page ("" on the last) and older its link
+
+    def __init__(self, rows:Iterator[tuple], size:int, link=None):
+        self.rows = rows
+        self.size = size
+        self.link = link
+        self.key = ""
+
+    def __iter__(self)->Iterator[tuple]:
+        last = None
+        for count, row in enumerate(self.rows):
+            if count == self.size:
+                self.key = f"{last[3]}_{last[4]}"
+                break
+            last = row
+            yield row[:4]
+        return
+
+    @property
+    def older(self)->str:
+        return self.link(self.key) if self.key and self.link else ""
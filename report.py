@@ -0,0 +1,94 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Single pass aggregation of records for reports
+
+import sqlite3 as sql
+import database as db
+from datetime import datetime
+from dataclasses import dataclass, field
+
+
+#Position of each selection in the monthly totals
+SELECTS = {"all":0, "positive":1, "negative":2}
+
+
+@dataclass
+class Ledger:
+    types:dict[str, int]
+    count:int = 0
+    #Sorted amounts per type id
+    amounts:dict[int, list[float]] = field(default_factory=dict)
+    #Month -> [net, inflow, outflow, records, inflow records, outflow records]
+    months:dict[str, list[float]] = field(default_factory=dict)
+
+
+def scan(cursor:sql.Cursor, **kwargs)->Ledger:
+    types = db.get_types(cursor)
+    ledger = Ledger(types)
+    pred, params = db.apply_filters(cursor=cursor, types=types, **kwargs)
+    rows = cursor.execute(f"SELECT records.type, strftime('%Y-%m', records.date), amount FROM records {pred};", params)
+    amounts = ledger.amounts
+    months = ledger.months
+    for type_, month, amount in rows:
+        ledger.count+=1
+        if type_ in amounts:
+            amounts[type_].append(amount)
+        else:
+            amounts[type_] = [amount]
+        if month not in months:
+            months[month] = [0, 0, 0, 0, 0, 0]
+        totals = months[month]
+        totals[0]+=amount
+        totals[3]+=1
+        if amount > 0:
+            totals[1]+=amount
+            totals[4]+=1
+        elif amount < 0:
+            totals[2]+=amount
+            totals[5]+=1
+    for values in amounts.values():
+        values.sort()
+    return ledger
+
+
+def total(ledger:Ledger, select:str="all"):
+    assert select in SELECTS, f"Selection must be of kind: {','.join(list(SELECTS.keys()))}"
+    index = SELECTS[select]
+    totals = [m for m in ledger.months.values() if m[index+3]]
+    if totals:
+        return sum([m[index] for m in totals])
+    return None
+
+
+def monthly(ledger:Ledger, select:str="all", force_end_date:datetime=None)->list[tuple[str, float]]:
+    assert select in SELECTS, f"Selection must be of kind: {','.join(list(SELECTS.keys()))}"
+    index = SELECTS[select]
+    flows = sorted([(month, m[index]) for month, m in ledger.months.items() if m[index+3]])
+    return db.fill_months(flows, force_end_date)
+
+
+def monthly_stats(flows:list[tuple[str, float]])->dict[str, float]:
+    data = [f[1] for f in flows]
+    stats = {"median":None, "mean":None, "sd":None, "max":None, "min":None}
+    if data:
+        var = db.variance(data)
+        stats["median"] = db.median(data)
+        stats["mean"] = db.mean(data)
+        stats["sd"] = var**0.5 if var else None
+        stats["max"] = max(data)
+        stats["min"] = min(data)
+    return stats
+
+
+def type_stats(ledger:Ledger, type_:str)->dict[str, float]:
+    if type_ not in ledger.types:
+        raise ValueError(f"Unrecognized type: {type_}")
+    data = ledger.amounts.get(ledger.types[type_], [])
+    stats = {"median":None, "mean":None, "std":None, "max":None, "min":None}
+    if data:
+        stats["median"] = db.median(data, ordered=True)
+        stats["mean"] = db.mean(data)
+        stats["std"] = db.variance(data)**0.5
+        stats["max"] = data[-1]
+        stats["min"] = data[0]
+    return stats
@@ -0,0 +1,92 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Flows summed into calendar periods with numpy datetime64, periods without records are filled with 0
+
+import numpy as np
+from datetime import datetime
+
+
+PERIODS = ["day", "week", "month", "quarter", "year"]
+
+
+def days(dates)->np.ndarray:
+    #Dates as YYYY-MM-DD, YYYY-MM or YYYY strings, datetimes or datetime64
+    if isinstance(dates, datetime):
+        dates = [dates.date()]
+    elif isinstance(dates, str):
+        dates = [dates]
+    return np.asarray(dates, dtype="datetime64[D]")
+
+
+def bucket(dates:np.ndarray, period:str)->np.ndarray:
+    #Number of the period each date falls in, consecutive periods have consecutive numbers
+    assert period in PERIODS, f"Period must be: {','.join(PERIODS)}"
+    if period == "day":
+        return dates.astype(np.int64)
+    if period == "week":
+        #1970-01-01 is a Thursday, weeks start on Monday
+        return (dates.astype(np.int64)+3)//7
+    if period == "year":
+        return dates.astype("datetime64[Y]").astype(np.int64)
+    months = dates.astype("datetime64[M]").astype(np.int64)
+    if period == "quarter":
+        return months//3
+    return months
+
+
+def labels(buckets:np.ndarray, period:str)->list[str]:
+    #First day of each period, as YYYY-MM for months and quarters and YYYY for years
+    if period == "day":
+        starts = buckets.astype("datetime64[D]")
+    elif period == "week":
+        starts = (buckets*7-3).astype("datetime64[D]")
+    elif period == "month":
+        starts = buckets.astype("datetime64[M]")
+    elif period == "quarter":
+        starts = (buckets*3).astype("datetime64[M]")
+    else:
+        starts = buckets.astype("datetime64[Y]")
+    return np.datetime_as_string(starts).tolist()
+
+
+def resample(flows:list[tuple[str, float]], period:str="month", start:datetime=None, end:datetime=None)->list[tuple[str, float]]:
+    #Every period from the first flow (or start) to the last flow (or end)
+    if not flows:
+        return []
+    ids = bucket(days([f[0] for f in flows]), period)
+    amounts = np.asarray([f[1] for f in flows], dtype=np.float64)
+    low = ids.min() if start is None else bucket(days(start), period)[0]
+    high = ids.max() if end is None else bucket(days(end), period)[0]
+    assert high >= low, f"End date must be equal or greater than start date"
+    inside = (ids >= low)&(ids <= high)
+    totals = np.bincount(ids[inside]-low, weights=amounts[inside], minlength=high-low+1)
+    return list(zip(labels(np.arange(low, high+1), period), totals.tolist()))
+
+
+def cumulative(flows:list[tuple[str, float]])->list[tuple[str, float]]:
+    if not flows:
+        return []
+    totals = np.cumsum(np.asarray([f[1] for f in flows], dtype=np.float64))
+    return list(zip([f[0] for f in flows], totals.tolist()))
+
+
+def carry(balances:list[tuple[str, float]], period:str="month", start:datetime=None, end:datetime=None)->list[tuple[str, float]]:
+    #Balance at the close of every period from the first balance (or start) to the last (or end). Balances must be
+    #in date order, periods without one keep the balance of the period before (0 before the first)
+    if not balances and (start is None or end is None):
+        return []
+    ids = bucket(days([b[0] for b in balances]), period)
+    values = np.asarray([b[1] for b in balances], dtype=np.float64)
+    low = ids.min() if start is None else bucket(days(start), period)[0]
+    high = ids.max() if end is None else bucket(days(end), period)[0]
+    assert high >= low, f"End date must be equal or greater than start date"
+    #Balances before start close the period of start
+    inside = ids <= high
+    ids, values = np.maximum(ids[inside], low)-low, values[inside]
+    closing = np.full(high-low+1, -1)
+    if ids.size:
+        last = np.flatnonzero(np.append(ids[1:] != ids[:-1], True))
+        closing[ids[last]] = last
+    closing = np.maximum.accumulate(closing)
+    totals = np.where(closing >= 0, values[np.maximum(closing, 0)] if values.size else 0.0, 0.0)
+    return list(zip(labels(np.arange(low, high+1), period), totals.tolist()))
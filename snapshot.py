@@ -0,0 +1,152 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Binary columnar snapshots of the records for fast backup and restore
+#
+#Layout, little endian, every column aligned to 8 bytes so it can be memory mapped:
+#   magic (8 bytes) | header size (uint64) | JSON header | columns
+#The header lists the types (id, name), the number of rows and, per column, its dtype, offset and length.
+#Columns: type (uint16 type id), amount (int64 cents, or float64 when some amount isn't whole cents),
+#date (int32 days since 1970-01-01), description (uint32 index into the string table),
+#strings (uint64 offsets, one more than strings) and text (UTF-8 bytes of every distinct description).
+
+import os
+import json
+import mmap
+import numpy as np
+import sqlite3 as sql
+import database as db
+
+
+MAGIC = b"AFSNAP1\0"
+ALIGN = 8
+
+
+def aligned(size:int)->int:
+    return (size+ALIGN-1)//ALIGN*ALIGN
+
+
+def export(cursor:sql.Cursor, location:str, size:int=50000)->int:
+    types = db.get_types(cursor)
+    kinds, amounts, dates, descriptions = [], [], [], []
+    table = {}
+    cursor.execute("SELECT type, amount, date, description FROM records ORDER BY id;")
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        for type_, amount, date, description in rows:
+            kinds.append(type_)
+            amounts.append(amount)
+            dates.append(date)
+            descriptions.append(table.setdefault(description, len(table)))
+    amounts = np.array(amounts, dtype="<f8")
+    cents = np.round(amounts*100)
+    if np.array_equal(cents/100, amounts):
+        amounts = cents.astype("<i8")
+    text = [d.encode() for d in table]
+    offsets = np.zeros(len(text)+1, dtype="<u8")
+    np.cumsum([len(t) for t in text], out=offsets[1:])
+    columns = {
+        "type":np.array(kinds, dtype="<u2"),
+        "amount":amounts,
+        "date":np.array(dates, dtype="datetime64[D]").astype("<i4"),
+        "description":np.array(descriptions, dtype="<u4"),
+        "strings":offsets,
+        "text":np.frombuffer(b"".join(text), dtype="u1"),
+    }
+    header = {"rows":len(kinds), "types":[[id_, type_] for type_, id_ in types.items()], "columns":{}}
+    layout = {}
+    body = 0
+    for name, column in columns.items():
+        layout[name] = body
+        body = aligned(body+column.nbytes)
+    #Offsets are absolute, grow the room left for the header until it fits in front of the columns
+    start = 0
+    while True:
+        for name, column in columns.items():
+            header["columns"][name] = {"dtype":column.dtype.str, "offset":start+layout[name], "length":len(column)}
+        encoded = json.dumps(header).encode()
+        if aligned(len(MAGIC)+8+len(encoded)) <= start:
+            break
+        start = aligned(len(MAGIC)+8+len(encoded))
+    encoded = encoded.ljust(start-len(MAGIC)-8)
+    partial = location+".partial"
+    with open(partial, "wb") as fd:
+        fd.write(MAGIC)
+        fd.write(len(encoded).to_bytes(8, "little"))
+        fd.write(encoded)
+        for name, column in columns.items():
+            fd.seek(header["columns"][name]["offset"])
+            fd.write(column.tobytes())
+        fd.truncate(start+body)
+    os.replace(partial, location)
+    return len(kinds)
+
+
+def columns(buffer)->tuple[dict, dict[str, np.ndarray]]:
+    assert bytes(buffer[:len(MAGIC)]) == MAGIC, "Not an AutoFinance snapshot"
+    size = int.from_bytes(buffer[len(MAGIC):len(MAGIC)+8], "little")
+    header = json.loads(bytes(buffer[len(MAGIC)+8:len(MAGIC)+8+size]))
+    arrays = {}
+    for name, column in header["columns"].items():
+        arrays[name] = np.frombuffer(buffer, dtype=column["dtype"], count=column["length"], offset=column["offset"])
+    return header, arrays
+
+
+def load(cn:sql.Connection, header:dict, arrays:dict[str, np.ndarray], replace:bool, size:int):
+    cursor = cn.cursor()
+    offsets = arrays["strings"]
+    text = arrays["text"].tobytes()
+    strings = [text[offsets[i]:offsets[i+1]].decode() for i in range(len(offsets)-1)]
+    if cn.in_transaction:
+        cn.commit()
+    cursor.execute("BEGIN;")
+    try:
+        types = db.get_types(cursor)
+        kinds = np.arange(max([id_ for id_, _ in header["types"]]+[int(arrays["type"].max(initial=0))])+1)
+        for id_, type_ in header["types"]:
+            if type_ not in types:
+                cursor.execute("INSERT INTO types(type) VALUES(?);", (type_,))
+                types[type_] = cursor.lastrowid
+            kinds[id_] = types[type_]
+        #Triggers and indexes are recreated once the records are in, cheaper than maintaining them row by row
+        schema = list(cursor.execute("SELECT type, name, sql FROM sqlite_master\
+                                      WHERE type IN ('trigger', 'index') AND tbl_name='records' AND sql IS NOT NULL;"))
+        for kind, name, _ in schema:
+            cursor.execute(f"DROP {kind.upper()} {name};")
+        if replace:
+            cursor.execute("DELETE FROM records;")
+        for start in range(0, header["rows"], size):
+            end = start+size
+            kind = kinds[arrays["type"][start:end]].tolist()
+            amount = arrays["amount"][start:end]
+            amount = (amount/100 if amount.dtype.kind == "i" else amount).tolist()
+            date = np.datetime_as_string(arrays["date"][start:end].astype("datetime64[D]")).tolist()
+            description = [strings[i] for i in arrays["description"][start:end].tolist()]
+            cursor.executemany("INSERT INTO records(type, description, amount, date) VALUES(?,?,?,?);",\
+                               zip(kind, description, amount, date))
+        for _, _, statement in schema:
+            cursor.execute(statement)
+        if db.has_rollup(cursor):
+            db.rebuild_rollup(cursor)
+        if db.has_search(cursor):
+            db.create_search(cursor)
+        if db.has_revision(cursor):
+            db.bump_revision(cursor)
+    except Exception:
+        cursor.execute("ROLLBACK;")
+        raise
+    cursor.execute("COMMIT;")
+    return
+
+
+def restore(cn:sql.Connection, location:str, replace:bool=True, size:int=50000)->int:
+    #Bulk load without the records triggers and indexes, the rollup and search index are rebuilt once at the end
+    with open(location, "rb") as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        header, arrays = columns(buffer)
+        try:
+            load(cn, header, arrays, replace, size)
+        finally:
+            #Views into the mapping must be gone before it is closed
+            del arrays
+    return header["rows"]
@@ -0,0 +1,179 @@
+#!./venv/bin/python3
+#Fernando Lavarreda
+#Charts drawn straight to SVG, same interface as graph without matplotlib
+
+import math
+from html import escape
+from datetime import datetime
+
+
+WIDTH = 640
+HEIGHT = 480
+#Plot area inside the picture: left, top, right, bottom
+AREA = (75, 35, 620, 395)
+BACKGROUND = "#000000"
+FOREGROUND = "#ffffff"
+DEFAULT_COLORS = ["#8dd3c7", "#feffb3", "#bfbbd9", "#fa8174", "#81b1d2"]
+COLORS = {
+    "blue":"#158eb3",
+    "red":"#c91224",
+    "green":"#109123",
+    "golden":"#e3b019",
+}
+
+
+def timestamp(x)->float:
+    if isinstance(x, datetime):
+        return x.timestamp()
+    if len(x) == 4:
+        return datetime.strptime(x, "%Y").timestamp()
+    if len(x) == 7:
+        return datetime.strptime(x, "%Y-%m").timestamp()
+    return datetime.strptime(x[:10], "%Y-%m-%d").timestamp()
+
+
+def nice_ticks(low:float, high:float, count:int=6)->list[float]:
+    if low == high:
+        low, high = low-1, high+1
+    raw = (high-low)/count
+    magnitude = 10**math.floor(math.log10(raw))
+    step = min([s*magnitude for s in (1, 2, 2.5, 5, 10) if s*magnitude >= raw])
+    first = math.ceil(low/step)*step
+    ticks = []
+    tick = first
+    while tick <= high+step*1e-9:
+        ticks.append(round(tick, 10))
+        tick+=step
+    return ticks
+
+
+def number(value:float)->str:
+    if abs(value) >= 1e6:
+        return f"{value/1e6:g}M"
+    return f"{value:g}"
+
+
+def scale(low:float, high:float, start:float, end:float):
+    if low == high:
+        return lambda v: (start+end)/2
+    factor = (end-start)/(high-low)
+    return lambda v: start+(v-low)*factor
+
+
+def axes(xs:list[float], ys:list[float], title:str=None, xlabel:str="Date", ylabel:str="Money", dates:bool=True):
+    #Frame, ticks and labels; returns the svg parts and the functions mapping data to the picture
+    left, top, right, bottom = AREA
+    xlow, xhigh = min(xs), max(xs)
+    if xlow == xhigh:
+        xlow, xhigh = xlow-86400, xhigh+86400
+    yticks = nice_ticks(min(ys), max(ys))
+    ylow, yhigh = min(yticks+list(ys)), max(yticks+list(ys))
+    margin = (xhigh-xlow)*0.05
+    fx = scale(xlow-margin, xhigh+margin, left, right)
+    fy = scale(ylow, yhigh, bottom, top)
+    parts = [f'<rect x="{left}" y="{top}" width="{right-left}" height="{bottom-top}" fill="none" stroke="{FOREGROUND}"/>']
+    for tick in yticks:
+        y = fy(tick)
+        parts.append(f'<line x1="{left-4}" y1="{y:.1f}" x2="{left}" y2="{y:.1f}" stroke="{FOREGROUND}"/>')
+        parts.append(f'<text x="{left-7}" y="{y+4:.1f}" text-anchor="end">{number(tick)}</text>')
+    if dates:
+        span = xhigh-xlow
+        fmt = "%Y-%m-%d" if span < 86400*90 else "%Y-%m"
+        for i in range(8):
+            tick = xlow+span*i/7
+            x = fx(tick)
+            label = datetime.fromtimestamp(tick).strftime(fmt)
+            parts.append(f'<line x1="{x:.1f}" y1="{bottom}" x2="{x:.1f}" y2="{bottom+4}" stroke="{FOREGROUND}"/>')
+            parts.append(f'<text x="{x:.1f}" y="{bottom+12}" text-anchor="end" transform="rotate(-75 {x:.1f} {bottom+12})">{label}</text>')
+    if xlabel:
+        parts.append(f'<text x="{(left+right)/2}" y="{HEIGHT-8}" text-anchor="middle">{escape(xlabel)}</text>')
+    if ylabel:
+        parts.append(f'<text x="14" y="{(top+bottom)/2}" text-anchor="middle" transform="rotate(-90 14 {(top+bottom)/2})">{escape(ylabel)}</text>')
+    if title:
+        parts.append(f'<text x="{(left+right)/2}" y="{top-12}" text-anchor="middle" font-size="14">{escape(str(title))}</text>')
+    return parts, fx, fy
+
+
+def line(points:list[tuple[float, float]], color:str)->str:
+    path = " ".join([f"{x:.1f},{y:.1f}" for x, y in points])
+    return f'<polyline points="{path}" fill="none" stroke="{color}" stroke-width="1.5"/>'
+
+
+def dots(points:list[tuple[float, float]], color:str)->str:
+    circles = "".join([f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3"/>' for x, y in points])
+    return f'<g fill="{color}">{circles}</g>'
+
+
+def legend(labels:list[str], colors:list[str], x:float, y:float)->list[str]:
+    parts = []
+    for i, (label, color) in enumerate(zip(labels, colors)):
+        row = y+i*18
+        parts.append(f'<line x1="{x}" y1="{row}" x2="{x+20}" y2="{row}" stroke="{color}" stroke-width="3"/>')
+        parts.append(f'<text x="{x+26}" y="{row+4}">{escape(str(label))}</text>')
+    return parts
+
+
+def write(save:str, parts:list[str])->str:
+    content = f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" viewBox="0 0 {WIDTH} {HEIGHT}"'\
+              f' font-family="sans-serif" font-size="10" fill="{FOREGROUND}">'\
+              f'<rect width="100%" height="100%" fill="{BACKGROUND}"/>'+"".join(parts)+"</svg>"
+    with open(save, "w") as fd:
+        fd.write(content)
+    return save
+
+
+def mseries(records:list[list[datetime, float]], *, save:str="", labels:list[str]=[], colors:list[str]=[], absolute:bool=False):
+    assert len(labels) == len(records), f"Labels should match number of series"
+    cp = [COLORS[color] if color in COLORS else color for color in colors]
+    if not records or (sum([len(r) for r in records]) == 0):
+        return ""
+    cp+=DEFAULT_COLORS[:max(len(records)-len(cp), 0)]
+    data = []
+    for record in records:
+        ys = [abs(r[1]) if absolute else r[1] for r in record]
+        xs = [timestamp(r[0]) for r in record]
+        data.append((xs, ys))
+    parts, fx, fy = axes([x for xs, _ in data for x in xs], [y for _, ys in data for y in ys])
+    for (xs, ys), color in zip(data, cp):
+        parts.append(line([(fx(x), fy(y)) for x, y in zip(xs, ys)], color))
+    parts+=legend(labels, cp, AREA[0]+10, AREA[1]+14)
+    return write(save, parts)
+
+
+def series(records:list[datetime, float], save:str, color:str="blue", absolute:bool=False, title:str=None, scatter:bool=False):
+    color = COLORS[color] if color in COLORS else color
+    if not records:
+        return ""
+    ys = [abs(r[1]) if absolute else r[1] for r in records]
+    xs = [timestamp(r[0]) for r in records]
+    parts, fx, fy = axes(xs, ys, title=title)
+    points = [(fx(x), fy(y)) for x, y in zip(xs, ys)]
+    if scatter or len(records) == 1:
+        parts.append(dots(points, color))
+    else:
+        parts.append(line(points, color))
+    return write(save, parts)
+
+
+def bar(xs:list[str], ins:list[float], out:list[float], save:str,\
+        color_in:str="blue", color_out:str="red"):
+    assert len(ins) == len(out), f"Should provide same number of inflows and outflows"
+    assert len(xs) == len(out), f"Should provide same number of labels and inflows"
+    color_in = COLORS[color_in] if color_in in COLORS else color_in
+    color_out = COLORS[color_out] if color_out in COLORS else color_out
+    if not xs:
+        return ""
+    left, top, right, bottom = AREA
+    positions = list(range(len(xs)))
+    parts, _, fy = axes(positions, [0, max(ins+out)*1.05], xlabel="", ylabel="", dates=False)
+    slot = (right-left)/len(xs)
+    width = slot*0.3
+    for i, label in enumerate(xs):
+        center = left+slot*(i+0.5)
+        for offset, value, color in ((-width, ins[i], color_in), (0, out[i], color_out)):
+            y = fy(value)
+            parts.append(f'<rect x="{center+offset:.1f}" y="{y:.1f}" width="{width:.1f}" height="{fy(0)-y:.1f}" fill="{color}"/>')
+            parts.append(f'<text x="{center+offset+width/2:.1f}" y="{y-3:.1f}" text-anchor="middle">{number(value)}</text>')
+        parts.append(f'<text x="{center:.1f}" y="{bottom+14}" text-anchor="middle">{escape(str(label))}</text>')
+    parts+=legend(["Inflow", "Outflow"], [color_in, color_out], right-90, top+14)
+    return write(save, parts)